@@ -0,0 +1,182 @@
+from utils import DecisionNode, ChanceNode, TerminalNode, TreeNode, InformationSets
+from flat_game import compile_game, TERMINAL, CHANCE, DECISION, PLAYERS
+
+### Lossless abstraction by merging isomorphic chance outcomes ###
+
+# Nodes and info sets are colored by refinement, starting from a node's type, payoffs, player
+# and actions, every round a node's color is combined with the colors of its children (in action
+# order at decision nodes, as a multiset of (probability, color) at chance nodes), its parent and
+# the probability of the edge into it and its info set, and an info set's color with the multiset
+# of its members' colors, until the partition is stable. The parent context keeps apart nodes
+# whose subtrees match but that are reached with different probabilities, which would change
+# the beliefs at their info sets.
+# Children of a chance node with equal colors are strategically equivalent copies (e.g. card
+# suits), so all but one are dropped and the kept one gets their combined probability, and
+# every info set of a dropped subtree is merged into the corresponding info set of the kept one
+
+class Interner:
+    # Exact canonical ids for hashable signatures, no hash collisions
+    def __init__(self):
+        self.ids = {}
+
+    def __call__(self, signature):
+        return self.ids.setdefault(signature, len(self.ids))
+
+def refine_colors(game):
+    # Stable node and info set colors of a compiled game
+    kind, player, info_set, child_start, child_count, prob, payoffs = game.node_lists()
+    n = game.num_nodes
+    parent = game.parent.tolist()
+    members = [[] for _ in range(game.num_info_sets)]
+    for node in range(n):
+        if kind[node] == DECISION:
+            members[info_set[node]].append(node)
+
+    intern = Interner()
+    node_color = []
+    for node in range(n):
+        if kind[node] == TERMINAL:
+            node_color.append(intern(('T', tuple(round(v, 9) for v in payoffs[node]))))
+        elif kind[node] == CHANCE:
+            node_color.append(intern(('C', child_count[node])))
+        else:
+            node_color.append(intern(('D', player[node], tuple(game.info_set_actions[info_set[node]]))))
+    info_set_color = [0] * game.num_info_sets
+    num_colors = len(set(node_color)) + 1
+    while True:
+        # Every new color includes the old one, so each round refines the previous partition
+        intern = Interner()
+        new_node_color = []
+        for node in range(n):
+            start, count = child_start[node], child_count[node]
+            if kind[node] == CHANCE:
+                children = tuple(sorted((round(prob[c], 12), node_color[c]) for c in range(start, start + count)))
+            else:
+                children = tuple(node_color[c] for c in range(start, start + count))
+            up = (node_color[parent[node]], round(prob[node], 12)) if node > 0 else None
+            own = info_set_color[info_set[node]] if kind[node] == DECISION else None
+            new_node_color.append(intern((node_color[node], children, up, own)))
+        info_set_color = [intern((info_set_color[i], tuple(sorted(node_color[m] for m in members[i]))))
+                          for i in range(game.num_info_sets)]
+        node_color = new_node_color
+        colors = len(set(node_color)) + len(set(info_set_color))
+        if colors == num_colors:
+            return node_color, info_set_color
+        num_colors = colors
+
+class Abstraction:
+    # The abstract game (tree, info_sets) and info_set_map from every original info set name to
+    # the name of the abstract info set that plays for it
+    def __init__(self, tree, info_sets, info_set_map):
+        self.tree = tree
+        self.info_sets = info_sets
+        self.info_set_map = info_set_map
+
+    def expand_strategy(self, strategy):
+        # Strategy of the abstract game ({info set: {action: prob}}) for the original info sets
+        return {name: dict(strategy[abstract]) for name, abstract in self.info_set_map.items()
+                if abstract in strategy}
+
+def abstract_game(tree, info_sets):
+    # Merge strategically equivalent chance outcomes of a game, returns an Abstraction. The
+    # original tree and info sets are left untouched
+    game = compile_game(tree, info_sets)
+    kind, player, info_set, child_start, child_count, prob, payoffs = game.node_lists()
+    node_color, _ = refine_colors(game)
+
+    # Union find over info sets, merged through corresponding nodes of dropped subtrees
+    parent = list(range(game.num_info_sets))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        i, j = find(i), find(j)
+        if i != j:
+            parent[max(i, j)] = min(i, j)
+
+    def match(kept, dropped):
+        # Walk two equally colored subtrees in step, merging the info sets of their decision nodes
+        stack = [(kept, dropped)]
+        while stack:
+            u, v = stack.pop()
+            if kind[u] == DECISION:
+                union(info_set[u], info_set[v])
+                stack.extend(zip(game.children(u), game.children(v)))
+            elif kind[u] == CHANCE:
+                key = lambda c: (round(prob[c], 12), node_color[c])
+                stack.extend(zip(sorted(game.children(u), key=key), sorted(game.children(v), key=key)))
+
+    # Top down over kept nodes, at every chance node keep the first child of each color
+    kept_children = {}
+    merged_prob = list(prob)
+    stack = [0]
+    while stack:
+        node = stack.pop()
+        if kind[node] == TERMINAL:
+            continue
+        children = list(game.children(node))
+        if kind[node] == CHANCE:
+            first = {}
+            kept = []
+            for c in children:
+                if node_color[c] in first:
+                    k = first[node_color[c]]
+                    merged_prob[k] += merged_prob[c]
+                    match(k, c)
+                else:
+                    first[node_color[c]] = c
+                    kept.append(c)
+            children = kept
+        kept_children[node] = children
+        stack.extend(children)
+
+    # Abstract info sets are named after the first original info set of each class
+    names = game.info_set_names
+    info_set_map = {name: names[find(i)] for i, name in enumerate(names)}
+    return Abstraction(*build_tree(game, kept_children, merged_prob, info_set_map), info_set_map)
+
+def build_tree(game, kept_children, merged_prob, info_set_map):
+    # Copy the kept nodes into a new TreeNode tree with merged chance probabilities
+    kind, player, info_set, child_start, child_count, prob, payoffs = game.node_lists()
+    members = {}
+    labels = {}
+
+    def copy(node):
+        original = game.nodes[node]
+        if kind[node] == TERMINAL:
+            return TreeNode(TerminalNode(dict(original.node.payoffs)))
+        # Labels of the original edges out of node
+        for label, child in original.children.items():
+            labels[id(child)] = label
+        children = [(labels[id(game.nodes[c])], c) for c in kept_children[node]]
+        if kind[node] == CHANCE:
+            tree_node = TreeNode(ChanceNode({label: merged_prob[c] for label, c in children}))
+        else:
+            tree_node = TreeNode(DecisionNode(PLAYERS[player[node]], list(original.node.actions)))
+            name = info_set_map[game.info_set_names[info_set[node]]]
+            tree_node.set_info_set(name)
+            members.setdefault(name, []).append(tree_node)
+        return tree_node
+
+    # Iterative copy so deep games don't hit the recursion limit
+    root = copy(0)
+    stack = [(0, root)]
+    while stack:
+        node, tree_node = stack.pop()
+        if kind[node] == TERMINAL:
+            continue
+        for c in kept_children[node]:
+            child = copy(c)
+            child.set_parent(tree_node)
+            tree_node.set_child(labels[id(game.nodes[c])], child)
+            stack.append((c, child))
+
+    info_sets = InformationSets()
+    for name in game.info_set_names:
+        if name in members:
+            info_sets.add_info_set(name, members[name])
+    return root, info_sets
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from utils import load_game_from_txt
+from generate_game import write_random
+from flat_game import compile_game
+from game_cache import load_flat_game
+from vectorized_cfr import VectorizedCFR
+from best_response import BestResponse
+from problem_5p2 import cfr_utility, init_tables
+from problem_5p3 import cfr_utility_dual, expectimax
+
+### Benchmarks ###
+
+# Bundled games are loaded from their files, synthetic ones are written by
+# generate_game.write_random with these (depth, branching, info_set_size), giving
+# info_set_size^2 * branching^depth leaves
+BUNDLED_GAMES = {'rps': './rock_paper_superscissors.txt', 'kuhn': './kuhn.txt', 'leduc': './leduc2.txt'}
+SYNTHETIC_GAMES = {'synthetic_small': (5, 2, 4), 'synthetic_medium': (4, 3, 9),
+                   'synthetic_large': (6, 3, 12)}
+
+def time_calls(fn, min_time, setup=None):
+    # Call fn until min_time seconds have passed in it (at least twice, the first call is a
+    # warm up that is not counted), returns the calls per second. setup() builds fn's argument
+    # before every call, outside of the timing
+    fn(*setup_args(setup))
+    calls = 0
+    elapsed = 0.0
+    while elapsed < min_time:
+        args = setup_args(setup)
+        start = time.perf_counter()
+        fn(*args)
+        elapsed += time.perf_counter() - start
+        calls += 1
+    return calls / elapsed
+
+def setup_args(setup):
+    return () if setup is None else (setup(),)
+
+def peak_memory(fn, setup=None):
+    # Peak memory in bytes allocated by Python during one call of fn
+    args = setup_args(setup)
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def benchmarks(tree, info_sets, game, path=None):
+    # The (name, function, setup) triples run on one game, see time_calls. The CFR functions
+    # run one iteration per call on fresh tables, so every call times the same traversal
+    passes = VectorizedCFR(game)
+    best_response = BestResponse(game)
+    uniform = game.uniform_strategy()
+    result = [('cfr_utility', lambda tables: cfr_utility(tree, info_sets, '1', 1.0, 1.0, *tables),
+               lambda: init_tables(info_sets, '1')),
+              ('cfr_utility_dual', lambda tables: cfr_utility_dual(tree, info_sets, *tables),
+               lambda: init_tables(info_sets)),
+              ('expectimax', lambda: expectimax(tree, info_sets, '1', {}), None),
+              ('vectorized_cfr_pass', lambda: passes.cfr_pass(uniform), None),
+              ('best_response', lambda: best_response.nash_gap(uniform), None)]
+    if path is not None:
+        result = [('load', lambda: load_game_from_txt(path), None),
+                  ('load_cached', lambda: load_game_from_txt(path, use_cache=True), None),
+                  ('load_flat', lambda: load_flat_game(path), None)] + result
+    return result
+
+def run_benchmarks(games=None, min_time=0.5, callback=None):
+    # One result per (game, benchmark) with calls/sec, nodes/sec (calls/sec * tree nodes) and
+    # peak memory of a single call, callback(result) is called as each result comes in
+    if games is None:
+        games = list(BUNDLED_GAMES) + list(SYNTHETIC_GAMES)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in games:
+            if name in BUNDLED_GAMES:
+                path = load_path = BUNDLED_GAMES[name]
+            else:
+                # The loaders are only timed on the bundled games
+                path, load_path = os.path.join(tmp_dir, f'{name}.txt'), None
+                depth, branching, info_set_size = SYNTHETIC_GAMES[name]
+                write_random(path, depth, branching, info_set_size)
+            tree, info_sets = load_game_from_txt(path)
+            game = compile_game(tree, info_sets)
+            for bench_name, fn, setup in benchmarks(tree, info_sets, game, load_path):
+                rate = time_calls(fn, min_time, setup)
+                result = {'game': name, 'benchmark': bench_name, 'nodes': game.num_nodes,
+                          'calls_per_sec': rate, 'nodes_per_sec': rate * game.num_nodes,
+                          'seconds_per_call': 1 / rate, 'peak_memory': peak_memory(fn, setup)}
+                results.append(result)
+                if callback is not None:
+                    callback(result)
+    return results
+
+def format_result(result):
+    return (f"{result['game']:18} {result['benchmark']:20} {result['seconds_per_call'] * 1000:10.3f} "
+            f"ms/call {result['nodes_per_sec']:14,.0f} nodes/s {result['peak_memory'] / 1024:10,.0f} KiB")
+
+### Baselines ###
+
+def save_baseline(path, results):
+    with open(path, 'w') as f:
+        json.dump({'python': sys.version.split()[0], 'machine': platform.machine(),
+                   'results': results}, f, indent=1)
+
+def compare(results, baseline_path, threshold=0.2):
+    # Regressions against a saved baseline: a benchmark is flagged when its throughput drops or
+    # its peak memory grows by more than threshold (a fraction)
+    with open(baseline_path) as f:
+        baseline = {(r['game'], r['benchmark']): r for r in json.load(f)['results']}
+    regressions = []
+    for result in results:
+        old = baseline.get((result['game'], result['benchmark']))
+        if old is None:
+            continue
+        speed = result['calls_per_sec'] / old['calls_per_sec']
+        memory = result['peak_memory'] / max(old['peak_memory'], 1)
+        if speed < 1 - threshold:
+            regressions.append(f"{result['game']} {result['benchmark']}: {speed:.2f}x throughput")
+        if memory > 1 + threshold:
+            regressions.append(f"{result['game']} {result['benchmark']}: {memory:.2f}x peak memory")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the game loader, CFR and best responses')
+    parser.add_argument('--games', nargs='+', choices=list(BUNDLED_GAMES) + list(SYNTHETIC_GAMES),
+                        help='games to run (default: all)')
+    parser.add_argument('--min-time', type=float, default=0.5, help='seconds to time each benchmark')
+    parser.add_argument('--save', help='write the results as a baseline JSON file')
+    parser.add_argument('--compare', help='baseline JSON file to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='allowed slowdown / memory growth as a fraction (default 0.2)')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.games, args.min_time, lambda result: print(format_result(result)))
+    if args.save:
+        save_baseline(args.save, results)
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        for regression in regressions:
+            print('REGRESSION', regression)
+        if regressions:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+import numpy as np
+from flat_game import TERMINAL, DECISION
+
+### Best response and Nash gap over a FlatGame ###
+
+class BestResponse:
+    def __init__(self, game):
+        self.game = game
+        num_actions = game.max_actions
+        parent = game.parent[1:]
+        children = np.arange(1, game.num_nodes)
+
+        # Best responses are chosen level by level when every info set of the responding player
+        # sits at one depth, otherwise info set by info set (see value_by_info_set)
+        info_set_depth = np.full(game.num_info_sets, -1)
+        decision_nodes = np.flatnonzero(game.kind == DECISION)
+        info_set_depth[game.info_set[decision_nodes]] = game.depth[decision_nodes]
+        mixed = info_set_depth[game.info_set[decision_nodes]] != game.depth[decision_nodes]
+        self.one_depth = [not np.any(mixed & (game.player[decision_nodes] == p)) for p in range(2)]
+        self.info_set_nodes = [[] for _ in range(game.num_info_sets)]
+        for node, i in zip(decision_nodes.tolist(), game.info_set[decision_nodes].tolist()):
+            self.info_set_nodes[i].append(node)
+
+        # Edges out of decision nodes and their slots in the flattened (info sets, actions) tables
+        decision_edges = game.kind[parent] == DECISION
+        self.edge_child = children[decision_edges]
+        self.edge_player = game.player[parent[decision_edges]]
+        self.edge_slot = (game.info_set[parent[decision_edges]].astype(np.int64) * num_actions
+                          + game.edge_action[self.edge_child])
+        self.table_size = game.num_info_sets * num_actions
+
+        self.levels = list(game.levels())
+        self.level_parents = [game.parent[start:end] for start, end in self.levels]
+        self.level_nonterminals = []
+        for start, end in self.levels:
+            nodes = np.arange(start, end)
+            nodes = nodes[game.kind[start:end] != TERMINAL]
+            self.level_nonterminals.append((nodes, game.child_start[nodes] - end))
+
+        # Per player and level, the responding player's decision nodes with their info sets,
+        # and the edges out of them with their table slots
+        self.level_decisions = {}
+        for p in range(2):
+            per_level = []
+            for start, end in self.levels:
+                nodes = np.arange(start, end)
+                nodes = nodes[(game.kind[start:end] == DECISION) & (game.player[start:end] == p)]
+                edge_parent, edge_child = game.edges(nodes)
+                edge_slot = (game.info_set[edge_parent].astype(np.int64) * num_actions
+                             + game.edge_action[edge_child])
+                per_level.append((nodes, edge_child, edge_slot))
+            self.level_decisions[p] = per_level
+
+    def value(self, strategy, player):
+        # Expected utility of the best response of player (0 or 1) to the other player's rows of
+        # the dense strategy table, returns the value and the best response as action indices
+        game = self.game
+        n = game.num_nodes
+
+        # Top down pass pushing opponent and chance reach to every node
+        edge_prob = game.prob.copy()
+        opponent_edges = self.edge_player != player
+        edge_prob[self.edge_child[opponent_edges]] = strategy.ravel()[self.edge_slot[opponent_edges]]
+        edge_prob[self.edge_child[~opponent_edges]] = 1.0
+        reach = np.ones(n)
+        for d in range(1, len(self.levels)):
+            start, end = self.levels[d]
+            reach[start:end] = reach[self.level_parents[d]] * edge_prob[start:end]
+
+        # Bottom up pass over reach weighted (counterfactual) values, chance and opponent nodes
+        # sum their children and the responding player takes the best action per info set
+        cf_values = reach * game.payoffs[:, player]
+        if not self.one_depth[player]:
+            return self.value_by_info_set(cf_values, player)
+        best_actions = np.zeros(game.num_info_sets, dtype=np.int64)
+        for d in range(len(self.levels) - 2, -1, -1):
+            nodes, offsets = self.level_nonterminals[d]
+            if len(nodes) == 0:
+                continue
+            start, end = self.levels[d+1]
+            cf_values[nodes] = np.add.reduceat(cf_values[start:end], offsets)
+
+            decision_nodes, edge_child, edge_slot = self.level_decisions[player][d]
+            if len(decision_nodes) == 0:
+                continue
+            action_values = np.bincount(edge_slot, cf_values[edge_child], minlength=self.table_size)
+            action_values = np.where(game.action_mask, action_values.reshape(game.action_mask.shape), -np.inf)
+            info_sets = game.info_set[decision_nodes]
+            best = np.argmax(action_values[info_sets], axis=1)
+            best_actions[info_sets] = best
+            cf_values[decision_nodes] = cf_values[game.child_start[decision_nodes] + best]
+
+        return float(cf_values[0]), best_actions
+
+    def value_by_info_set(self, cf_values, player):
+        # Bottom up pass for games where an info set of player spans several depths. An info
+        # set's action is chosen once the values below all of its nodes are known, which perfect
+        # recall makes well founded, and every node's value is computed once
+        kind, owner, info_set, child_start, child_count, _, _ = self.game.node_lists()
+        values = cf_values.tolist()
+        known = [k == TERMINAL for k in kind]
+        best_actions = np.zeros(self.game.num_info_sets, dtype=np.int64)
+        chosen = {}
+
+        def node_value(node):
+            if known[node]:
+                return values[node]
+            start = child_start[node]
+            if kind[node] == DECISION and owner[node] == player:
+                i = info_set[node]
+                if i not in chosen:
+                    totals = [0.0] * child_count[node]
+                    for member in self.info_set_nodes[i]:
+                        for a in range(len(totals)):
+                            totals[a] += node_value(child_start[member] + a)
+                    chosen[i] = best_actions[i] = totals.index(max(totals))
+                value = node_value(start + chosen[i])
+            else:
+                value = sum(node_value(child) for child in range(start, start + child_count[node]))
+            values[node] = value
+            known[node] = True
+            return value
+
+        return node_value(0), best_actions
+
+    def nash_gap(self, strategy):
+        # Sum of both players' best response values, zero exactly at a Nash equilibrium of a
+        # zero sum game
+        return self.value(strategy, 0)[0] + self.value(strategy, 1)[0]
@@ -0,0 +1,92 @@
+import numpy as np
+
+### CFR update rules ###
+
+# Every variant is expressed as vanilla CFR plus
+#   - floor_regrets: clamp accumulated regrets at zero after every update (CFR+)
+#   - alternating: update player 1 then player 2 within an iteration, the second traversal
+#     seeing player 1's updated regrets
+#   - alpha, beta, gamma: after iteration t multiply positive regrets by t^a/(t^a+1), negative
+#     regrets by t^b/(t^b+1) and the strategy sum by (t/(t+1))^g, None leaves them undiscounted
+# Linear averaging (weighting iteration t's strategy by t) is the same as gamma = 1
+
+class Variant:
+    def __init__(self, name='custom', alpha=None, beta=None, gamma=None, floor_regrets=False,
+                 alternating=False):
+        self.name = name
+        self.alpha = alpha
+        self.beta = beta
+        self.gamma = gamma
+        self.floor_regrets = floor_regrets
+        self.alternating = alternating
+
+    def params(self):
+        return {'name': self.name, 'alpha': self.alpha, 'beta': self.beta, 'gamma': self.gamma,
+                'floor_regrets': self.floor_regrets, 'alternating': self.alternating}
+
+    def discounts(self, t):
+        # Multipliers for positive regrets, negative regrets and the strategy sum after iteration t
+        positive = 1.0 if self.alpha is None else t ** self.alpha / (t ** self.alpha + 1)
+        negative = 1.0 if self.beta is None else t ** self.beta / (t ** self.beta + 1)
+        strategy = 1.0 if self.gamma is None else (t / (t + 1)) ** self.gamma
+        return positive, negative, strategy
+
+    def has_discounts(self):
+        return self.alpha is not None or self.beta is not None or self.gamma is not None
+
+VARIANTS = {
+    'vanilla': dict(),
+    'cfr+': dict(gamma=1.0, floor_regrets=True, alternating=True),
+    'linear': dict(alpha=1.0, beta=1.0, gamma=1.0),
+    'dcfr': dict(alpha=1.5, beta=0.0, gamma=2.0),
+}
+
+def make_variant(variant='vanilla', **params):
+    # Accepts a Variant or the name of one in VARIANTS (None for vanilla), params override its
+    # fields, e.g. make_variant('dcfr', alpha=2.0) or make_variant('linear', alternating=True)
+    if variant is None:
+        variant = 'vanilla'
+    if isinstance(variant, Variant):
+        if not params:
+            return variant
+        fields = variant.params()
+        fields.update(params)
+        return Variant(**fields)
+    if variant not in VARIANTS:
+        raise ValueError(f'Unknown CFR variant {variant}, expected one of {list(VARIANTS)}')
+    fields = dict(VARIANTS[variant])
+    fields.update(params)
+    return Variant(variant, **fields)
+
+### Applying the update rules to regret and strategy sum tables ###
+
+def floor_table(regrets):
+    np.maximum(regrets, 0, out=regrets)
+
+def discount_table(variant, regrets, strategy_sum, t):
+    if not variant.has_discounts():
+        return
+    positive, negative, strategy = variant.discounts(t)
+    regrets *= np.where(regrets > 0, positive, negative)
+    strategy_sum *= strategy
+
+def row_keys(row):
+    # Rows are either dicts keyed by action or lists indexed by action position
+    return row.keys() if isinstance(row, dict) else range(len(row))
+
+def floor_rows(regret_rows):
+    for row in regret_rows:
+        for a in row_keys(row):
+            if row[a] < 0:
+                row[a] = 0.0
+
+def discount_rows(variant, regret_rows, strategy_sum_rows, t):
+    if not variant.has_discounts():
+        return
+    positive, negative, strategy = variant.discounts(t)
+    for row in regret_rows:
+        for a in row_keys(row):
+            row[a] *= positive if row[a] > 0 else negative
+    for row in strategy_sum_rows:
+        for a in row_keys(row):
+            row[a] *= strategy
@@ -0,0 +1,73 @@
+import json
+import os
+import numpy as np
+from flat_game import TERMINAL
+
+### Solver checkpoints ###
+
+# A checkpoint is a compressed .npz holding the regret and strategy sum tables as dense
+# (info sets, actions) arrays of the compiled game and a JSON 'meta' entry with the iteration
+# counter, the variant parameters, the engine, the random number generator state of sampling
+# engines and the info set/action layout used to check the checkpoint matches the game
+
+class Checkpoint:
+    def __init__(self, regrets, strategy_sum, iteration, variant, engine, rng_state,
+                 info_set_names, info_set_actions):
+        self.regrets = regrets
+        self.strategy_sum = strategy_sum
+        self.iteration = iteration
+        self.variant = variant # dict of Variant params
+        self.engine = engine
+        self.rng_state = rng_state
+        self.info_set_names = info_set_names
+        self.info_set_actions = info_set_actions
+
+def save_checkpoint(path, game, solver, engine):
+    regrets, strategy_sum = solver.get_tables(game)
+    rng = getattr(solver, 'rng', None)
+    rng_state = None
+    if rng is not None:
+        version, state, gauss = rng.getstate()
+        rng_state = [version, list(state), gauss]
+    meta = {'iteration': solver.iteration, 'variant': solver.variant.params(), 'engine': engine,
+            'rng_state': rng_state, 'info_set_names': game.info_set_names,
+            'info_set_actions': game.info_set_actions}
+
+    # Write to a temporary file and rename so a run killed mid write keeps the last checkpoint
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez_compressed(f, regrets=regrets, strategy_sum=strategy_sum, meta=np.array(json.dumps(meta)))
+    os.replace(tmp_path, path)
+
+def load_checkpoint(path):
+    with np.load(path) as data:
+        meta = json.loads(str(data['meta']))
+        return Checkpoint(data['regrets'], data['strategy_sum'], meta['iteration'], meta['variant'],
+                          meta['engine'], meta['rng_state'], meta['info_set_names'],
+                          meta['info_set_actions'])
+
+def restore_checkpoint(checkpoint, game, solver):
+    # Load a checkpoint's tables, iteration counter and rng state into a freshly built engine,
+    # engines share the dense table layout so a run can resume with a different engine
+    if (checkpoint.info_set_names != game.info_set_names
+            or checkpoint.info_set_actions != game.info_set_actions):
+        raise ValueError('Checkpoint was saved for a different game')
+    solver.set_tables(game, checkpoint.regrets, checkpoint.strategy_sum)
+    solver.iteration = checkpoint.iteration
+    rng = getattr(solver, 'rng', None)
+    if rng is not None and checkpoint.rng_state is not None:
+        version, state, gauss = checkpoint.rng_state
+        rng.setstate((version, tuple(state), gauss))
+
+### Warm starting from a previous average strategy ###
+
+def warm_start_tables(game, avg_strategy, iters):
+    # Tables that reproduce avg_strategy as both the current and the average strategy, weighted
+    # as if it had been played for iters iterations. Regrets are scaled like CFR's regret growth
+    # (payoff range * sqrt(iters)) so the first new iterations don't immediately wash them out
+    strategy = game.dict_to_table(avg_strategy, default=game.uniform_strategy())
+    terminal_payoffs = game.payoffs[game.kind == TERMINAL]
+    payoff_range = float(terminal_payoffs.max() - terminal_payoffs.min()) or 1.0
+    regrets = strategy * payoff_range * np.sqrt(iters)
+    strategy_sum = strategy * iters
+    return regrets, strategy_sum
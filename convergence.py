@@ -0,0 +1,108 @@
+import contextlib
+import csv
+import json
+import math
+import os
+
+### Evaluation schedules ###
+
+# A schedule decides after which iterations (counted from 1) the solvers evaluate and record
+# metrics, the final iteration is always evaluated
+
+class EveryN:
+    def __init__(self, n):
+        if n < 1:
+            raise ValueError('EveryN needs n >= 1')
+        self.n = n
+
+    def due(self, iteration, elapsed):
+        return iteration % self.n == 0
+
+class LogSpaced:
+    # Geometrically spaced checkpoints, about points_per_decade evaluations per factor of 10
+    def __init__(self, points_per_decade=10):
+        if points_per_decade <= 0:
+            raise ValueError('LogSpaced needs points_per_decade > 0')
+        self.ratio = 10 ** (1 / points_per_decade)
+        self.next = 1.0
+
+    def due(self, iteration, elapsed):
+        if iteration < self.next:
+            return False
+        while self.next <= iteration:
+            self.next = max(self.next * self.ratio, math.floor(self.next) + 1)
+        return True
+
+class WallClock:
+    # Evaluate once at least seconds have passed since the previous evaluation
+    def __init__(self, seconds):
+        if seconds <= 0:
+            raise ValueError('WallClock needs seconds > 0')
+        self.seconds = seconds
+        self.last = 0.0
+
+    def due(self, iteration, elapsed):
+        if elapsed - self.last < self.seconds:
+            return False
+        self.last = elapsed
+        return True
+
+SCHEDULES = {'every': lambda v: EveryN(int(v)), 'log': lambda v: LogSpaced(float(v)),
+             'time': lambda v: WallClock(float(v))}
+
+def make_schedule(schedule):
+    # Accepts None (every iteration), a schedule object, or a spec string such as 'every:10',
+    # 'log:20' or 'time:5'
+    if schedule is None:
+        return EveryN(1)
+    if isinstance(schedule, str):
+        kind, _, value = schedule.partition(':')
+        if kind not in SCHEDULES or not value:
+            raise ValueError(f'Bad schedule {schedule!r}, expected one of every:N, log:N, time:SECONDS')
+        return SCHEDULES[kind](value)
+    return schedule
+
+### Streaming metrics log ###
+
+class ConvergenceLog:
+    # Appends one row of metrics per evaluation to a .jsonl or .csv file, flushing every row so
+    # the file can be tailed while a run is in progress. append keeps the rows already in the
+    # file (for resumed runs), the .csv header is only written to a new or empty file
+    def __init__(self, path, append=False):
+        ext = os.path.splitext(path)[1].lower()
+        if ext not in ('.jsonl', '.csv'):
+            raise ValueError(f'Convergence log must be a .jsonl or .csv file, got {path}')
+        self.path = path
+        self.format = ext[1:]
+        self.file = open(path, 'a' if append else 'w', newline='')
+        self.needs_header = self.file.tell() == 0
+        self.writer = None
+
+    def write(self, row):
+        if self.format == 'jsonl':
+            self.file.write(json.dumps(row) + '\n')
+        else:
+            if self.writer is None:
+                self.writer = csv.DictWriter(self.file, fieldnames=list(row))
+                if self.needs_header:
+                    self.writer.writeheader()
+            self.writer.writerow(row)
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+@contextlib.contextmanager
+def open_log(log, append=False):
+    # Accepts None, a path or an open ConvergenceLog, only logs opened here are closed here
+    if log is None or isinstance(log, ConvergenceLog):
+        yield log
+    else:
+        with ConvergenceLog(log, append) as opened:
+            yield opened
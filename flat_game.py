@@ -0,0 +1,199 @@
+from collections import deque
+import numpy as np
+
+### Flattened array representation of a game tree ###
+
+# Node kinds
+TERMINAL = 0
+CHANCE = 1
+DECISION = 2
+NODE_KINDS = {'TerminalNode': TERMINAL, 'ChanceNode': CHANCE, 'DecisionNode': DECISION}
+
+# Player names in the order of the payoff columns
+PLAYERS = ['1', '2']
+
+class FlatGame:
+    def __init__(self, kind, player, info_set, parent, depth, child_start, child_count,
+                 edge_action, prob, payoffs, level_start, info_set_names, info_set_player,
+                 info_set_actions, nodes=None):
+        # Per node arrays, nodes are in breadth first order so every parent comes before
+        # its children, the children of a node are contiguous and each depth is contiguous
+        self.kind = kind # int8, one of TERMINAL, CHANCE, DECISION
+        self.player = player # int8, index into PLAYERS for decision nodes else -1
+        self.info_set = info_set # int32, info set index for decision nodes else -1
+        self.parent = parent # int32, parent node index, -1 for the root
+        self.depth = depth # int32
+        self.child_start = child_start # int32, index of the first child
+        self.child_count = child_count # int32
+        self.edge_action = edge_action # int32, position of the node among its siblings
+        self.prob = prob # float64, chance probability of the edge into the node else 1
+        self.payoffs = payoffs # float64 (nodes, players), zero for non terminal nodes
+        self.level_start = level_start # int64, nodes at depth d are level_start[d]:level_start[d+1]
+
+        # Per info set data, the children of a decision node follow its info set's action order
+        self.info_set_names = info_set_names # list of strs
+        self.info_set_index = {name: i for i, name in enumerate(info_set_names)}
+        self.info_set_player = info_set_player # int8
+        self.info_set_actions = info_set_actions # list of lists of strs
+        self.num_actions = np.array([len(a) for a in info_set_actions], dtype=np.int32)
+        self.max_actions = int(self.num_actions.max()) if len(info_set_actions) else 0
+        # Mask of the valid entries in dense (info sets, max actions) tables
+        self.action_mask = np.arange(self.max_actions)[None, :] < self.num_actions[:, None]
+        # Info set by action index table, maps each valid (info set, action) pair to a
+        # compact sequence id and padding to -1
+        self.action_table = np.full(self.action_mask.shape, -1, dtype=np.int32)
+        self.action_table[self.action_mask] = np.arange(int(self.num_actions.sum()), dtype=np.int32)
+
+        # Original tree nodes in flat order, if compiled from a tree
+        self.nodes = nodes
+        self._node_lists = None
+        self._uniform_strategy = None
+
+    @property
+    def num_nodes(self):
+        return len(self.kind)
+
+    @property
+    def num_info_sets(self):
+        return len(self.info_set_names)
+
+    def children(self, node):
+        start = self.child_start[node]
+        return range(start, start + self.child_count[node])
+
+    def edges(self, nodes):
+        # The (parent, child) index arrays of all edges out of the given nodes
+        counts = self.child_count[nodes]
+        edge_parent = np.repeat(nodes, counts)
+        first_edge = np.repeat(np.cumsum(counts) - counts, counts)
+        edge_child = self.child_start[edge_parent] + np.arange(len(edge_parent)) - first_edge
+        return edge_parent, edge_child
+
+    def node_lists(self):
+        # Plain list copies of the per node arrays, indexing these is much cheaper than
+        # indexing numpy arrays one element at a time in recursive traversals
+        if self._node_lists is None:
+            self._node_lists = (self.kind.tolist(), self.player.tolist(), self.info_set.tolist(),
+                                self.child_start.tolist(), self.child_count.tolist(),
+                                self.prob.tolist(), self.payoffs.tolist())
+        return self._node_lists
+
+    def levels(self):
+        # Iterate over (start, end) slices of each depth from the root down
+        for d in range(len(self.level_start) - 1):
+            yield int(self.level_start[d]), int(self.level_start[d+1])
+
+    ### Conversions between dense tables and the nested dicts used by the solvers ###
+
+    def zeros(self):
+        return np.zeros(self.action_mask.shape)
+
+    def uniform_strategy(self):
+        if self._uniform_strategy is None:
+            self._uniform_strategy = self.action_mask / np.maximum(self.num_actions, 1)[:, None]
+        return self._uniform_strategy.copy()
+
+    def table_to_dict(self, table, info_set_names=None):
+        # Convert a dense (info sets, actions) table to {info set: {action: value}}
+        if info_set_names is None:
+            info_set_names = self.info_set_names
+        result = {}
+        for name in info_set_names:
+            i = self.info_set_index[name]
+            result[name] = {a: float(table[i, j]) for j, a in enumerate(self.info_set_actions[i])}
+        return result
+
+    def dict_to_table(self, values, default=None):
+        # Convert {info set: {action: value}} to a dense table, info sets missing from
+        # the dict are filled from the default table (zeros if not given)
+        table = self.zeros() if default is None else np.array(default, dtype=np.float64)
+        for name, action_values in values.items():
+            i = self.info_set_index[name]
+            for j, a in enumerate(self.info_set_actions[i]):
+                table[i, j] = action_values[a]
+        return table
+
+    def fill_dict(self, values, table):
+        # Overwrite the entries of an existing {info set: {action: value}} dict from a dense table
+        for name, action_values in values.items():
+            i = self.info_set_index[name]
+            for j, a in enumerate(self.info_set_actions[i]):
+                action_values[a] = float(table[i, j])
+
+### Compiling a game tree ###
+
+def compile_game(tree, info_sets):
+    # Info set ordering and action ordering come from the parsed info sets
+    info_set_names = list(info_sets.get_info_sets())
+    info_set_index = {name: i for i, name in enumerate(info_set_names)}
+    info_set_player = np.full(len(info_set_names), -1, dtype=np.int8)
+    info_set_actions = []
+    for i, name in enumerate(info_set_names):
+        actions = None
+        for node in info_sets.get_info_set(name):
+            if node.type != 'DecisionNode':
+                continue
+            if actions is None:
+                actions = list(node.node.actions)
+                info_set_player[i] = PLAYERS.index(node.node.player)
+            elif set(actions) != set(node.node.actions):
+                raise ValueError(f'Info set {name} has nodes with different actions')
+        info_set_actions.append(actions or [])
+
+    # Breadth first traversal
+    order = []
+    parents = []
+    edges = []
+    labels = []
+    queue = deque([(tree, -1, 0, None)])
+    while queue:
+        tree_node, parent, edge, label = queue.popleft()
+        index = len(order)
+        order.append(tree_node)
+        parents.append(parent)
+        edges.append(edge)
+        labels.append(label)
+        if tree_node.type == 'DecisionNode':
+            if tree_node.info_set not in info_set_index:
+                raise ValueError('Decision node is not in any info set')
+            actions = info_set_actions[info_set_index[tree_node.info_set]]
+        else:
+            actions = list(tree_node.children)
+        for j, a in enumerate(actions):
+            queue.append((tree_node.children[a], index, j, a))
+
+    n = len(order)
+    kind = np.empty(n, dtype=np.int8)
+    player = np.full(n, -1, dtype=np.int8)
+    info_set = np.full(n, -1, dtype=np.int32)
+    parent = np.array(parents, dtype=np.int32)
+    depth = np.zeros(n, dtype=np.int32)
+    child_start = np.zeros(n, dtype=np.int32)
+    child_count = np.zeros(n, dtype=np.int32)
+    edge_action = np.array(edges, dtype=np.int32)
+    prob = np.ones(n)
+    payoffs = np.zeros((n, len(PLAYERS)))
+
+    for i, tree_node in enumerate(order):
+        kind[i] = NODE_KINDS[tree_node.type]
+        if tree_node.type == 'DecisionNode':
+            player[i] = PLAYERS.index(tree_node.node.player)
+            info_set[i] = info_set_index[tree_node.info_set]
+        elif tree_node.type == 'TerminalNode':
+            for p, name in enumerate(PLAYERS):
+                payoffs[i, p] = tree_node.node.payoffs[name]
+        if i > 0:
+            p = parent[i]
+            depth[i] = depth[p] + 1
+            if child_count[p] == 0:
+                child_start[p] = i
+            child_count[p] += 1
+            if kind[p] == CHANCE:
+                prob[i] = order[p].node.probs[labels[i]]
+
+    # Breadth first order keeps every depth contiguous
+    level_start = np.searchsorted(depth, np.arange(depth.max() + 2)).astype(np.int64)
+
+    return FlatGame(kind, player, info_set, parent, depth, child_start, child_count,
+                    edge_action, prob, payoffs, level_start, info_set_names, info_set_player,
+                    info_set_actions, nodes=order)
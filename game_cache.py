@@ -0,0 +1,183 @@
+import hashlib
+import json
+import os
+import numpy as np
+from utils import DecisionNode, ChanceNode, TerminalNode, TreeNode, InformationSets, parse_game_file
+from flat_game import FlatGame, compile_game, PLAYERS, CHANCE, DECISION
+
+### Compiled binary cache of a parsed game ###
+
+# Layout: MAGIC, the header length as 8 little endian bytes, a JSON header describing the
+# source file, the string tables and every array (dtype, shape, offset), then the raw arrays
+# at 64 byte aligned offsets so they can be memory mapped in place
+
+MAGIC = b'GAMECACHE1\n'
+ALIGNMENT = 64
+CACHE_SUFFIX = '.gamecache'
+ARRAYS = ['kind', 'player', 'info_set', 'parent', 'depth', 'child_start', 'child_count',
+          'edge_action', 'prob', 'payoffs', 'level_start', 'info_set_player', 'label']
+
+def cache_path(filepath):
+    return filepath + CACHE_SUFFIX
+
+def file_digest(filepath):
+    digest = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def source_info(filepath, digest=None):
+    stat = os.stat(filepath)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'sha256': digest if digest is not None else file_digest(filepath)}
+
+def edge_labels(game):
+    # Label of the edge into every node as an index into a table of unique labels
+    labels = []
+    label_index = {}
+    label = np.full(game.num_nodes, -1, dtype=np.int32)
+    for i in range(1, game.num_nodes):
+        parent = game.parent[i]
+        edge = game.edge_action[i]
+        if game.kind[parent] == DECISION:
+            name = game.info_set_actions[game.info_set[parent]][edge]
+        else:
+            name = list(game.nodes[parent].children)[edge]
+        if name not in label_index:
+            label_index[name] = len(labels)
+            labels.append(name)
+        label[i] = label_index[name]
+    return labels, label
+
+def write_cache(filepath, game):
+    # Write the compiled game next to its source file, game must have been compiled from a tree
+    labels, label = edge_labels(game)
+    arrays = {name: getattr(game, name) for name in ARRAYS if name != 'label'}
+    arrays['label'] = label
+
+    header = {'source': source_info(filepath), 'info_set_names': game.info_set_names,
+              'info_set_actions': game.info_set_actions, 'labels': labels, 'arrays': {}}
+    # Offsets are relative to the end of the header so they don't depend on its length
+    offset = 0
+    for name, array in arrays.items():
+        array = np.ascontiguousarray(array)
+        arrays[name] = array
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    # Write to a temporary file and rename so readers never see a partial cache
+    path = cache_path(filepath)
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+def read_header(path):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            return None, 0
+        length = int.from_bytes(f.read(8), 'little')
+        header = json.loads(f.read(length).decode('utf-8'))
+    data_start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+    return header, data_start
+
+def is_fresh(filepath, source):
+    # Fresh if size and mtime are unchanged, or if the content hash still matches
+    stat = os.stat(filepath)
+    if stat.st_size != source['size']:
+        return False
+    if stat.st_mtime_ns == source['mtime_ns']:
+        return True
+    return file_digest(filepath) == source['sha256']
+
+def load_cached_game(filepath):
+    # Tree and info sets of filepath rebuilt from a fresh cache, or parsed from the text and
+    # cached for next time. Failing to write the cache (e.g. a read only directory) is ignored
+    cached = load_cache(filepath)
+    if cached is not None:
+        return tree_from_flat(*cached)
+    tree, info_sets = parse_game_file(filepath)
+    try:
+        write_cache(filepath, compile_game(tree, info_sets))
+    except (OSError, ValueError):
+        pass
+    return tree, info_sets
+
+def load_cache(filepath):
+    # Memory map the cached game of filepath, returns (FlatGame, labels) or None if the cache is
+    # missing, unreadable or stale
+    path = cache_path(filepath)
+    try:
+        header, data_start = read_header(path)
+        if header is None or not is_fresh(filepath, header['source']):
+            return None
+        arrays = {}
+        for name, spec in header['arrays'].items():
+            shape = tuple(spec['shape'])
+            if int(np.prod(shape)) == 0:
+                arrays[name] = np.zeros(shape, dtype=spec['dtype'])
+            else:
+                arrays[name] = np.memmap(path, dtype=spec['dtype'], mode='r',
+                                         offset=data_start + spec['offset'], shape=shape)
+    except (OSError, ValueError, KeyError):
+        return None
+    label = arrays.pop('label')
+    game = FlatGame(**{name: arrays[name] for name in ARRAYS if name != 'label'},
+                    info_set_names=header['info_set_names'],
+                    info_set_actions=header['info_set_actions'])
+    return game, [header['labels'][j] if j >= 0 else None for j in label.tolist()]
+
+def tree_from_flat(game, labels):
+    # Rebuild the TreeNode tree and InformationSets of a compiled game, labels holds the label of
+    # the edge into every node
+    kind, player, info_set, child_start, child_count, prob, payoffs = game.node_lists()
+    parent = game.parent.tolist()
+    tree_nodes = []
+    members = [[] for _ in game.info_set_names]
+    for i in range(game.num_nodes):
+        if kind[i] == DECISION:
+            node = DecisionNode(PLAYERS[player[i]], list(game.info_set_actions[info_set[i]]))
+        elif kind[i] == CHANCE:
+            start = child_start[i]
+            node = ChanceNode({labels[c]: prob[c] for c in range(start, start + child_count[i])})
+        else:
+            node = TerminalNode({name: payoffs[i][p] for p, name in enumerate(PLAYERS)})
+        tree_node = TreeNode(node)
+        if i > 0:
+            parent_node = tree_nodes[parent[i]]
+            tree_node.set_parent(parent_node)
+            parent_node.set_child(labels[i], tree_node)
+        if kind[i] == DECISION:
+            tree_node.set_info_set(game.info_set_names[info_set[i]])
+            members[info_set[i]].append(tree_node)
+        tree_nodes.append(tree_node)
+    game.nodes = tree_nodes
+
+    info_sets = InformationSets()
+    for name, nodes in zip(game.info_set_names, members):
+        info_sets.add_info_set(name, nodes)
+    return tree_nodes[0], info_sets
+
+def load_flat_game(filepath):
+    # Compiled game of filepath, memory mapped from the cache when it is fresh and otherwise
+    # parsed, compiled and cached
+    cached = load_cache(filepath)
+    if cached is not None:
+        return cached[0]
+    tree, info_sets = parse_game_file(filepath)
+    game = compile_game(tree, info_sets)
+    try:
+        write_cache(filepath, game)
+    except OSError:
+        pass
+    return game
@@ -0,0 +1,250 @@
+import argparse
+import random
+
+### Synthetic game files ###
+
+# Generators for games in the 'node ... / infoset ...' text format of the bundled games. Nodes
+# are written depth first as they are generated and info sets are enumerated from the public
+# tree afterwards, so memory stays proportional to the depth of the game, not its size
+
+RANK_NAMES = '23456789TJQKA'
+
+def format_prob(prob):
+    return f'{prob:.8g}'
+
+def format_payoffs(payoff):
+    return f'terminal payoffs 1={payoff:g} 2={-payoff:g}'
+
+### Leduc style poker ###
+
+class LeducRules:
+    # Two player poker with a deck of ranks x suits cards. Each player antes and gets one
+    # private card, then there are len(bets) betting rounds with a public board card dealt
+    # before every round after the first. bets[r] is the raise size of round r, or a tuple of
+    # sizes to allow several, and each round allows at most raise_cap raises. At showdown the
+    # player whose rank matches the most board cards wins, then the higher rank
+    # ranks=3, suits=2, bets=(2, 4), raise_cap=2, ante=1 is the game in leduc2.txt
+    def __init__(self, ranks=3, suits=2, bets=(2, 4), raise_cap=2, ante=1):
+        if not 1 <= ranks <= len(RANK_NAMES):
+            raise ValueError(f'ranks must be between 1 and {len(RANK_NAMES)}')
+        if ranks * suits < len(bets) + 1:
+            raise ValueError('The deck is too small for the private and board cards')
+        # Highest ranks up to the king like Leduc's J Q K, the ace only comes in with 13 ranks
+        start = max(0, len(RANK_NAMES) - 1 - ranks)
+        self.ranks = RANK_NAMES[start:start + ranks]
+        self.suits = suits
+        self.bets = [tuple(b) if isinstance(b, (tuple, list)) else (b,) for b in bets]
+        self.raise_cap = raise_cap
+        self.ante = ante
+
+    def deal_probs(self):
+        # {(rank 1, rank 2): probability} of the private cards
+        n = len(self.ranks) * self.suits
+        probs = {}
+        for r1 in range(len(self.ranks)):
+            for r2 in range(len(self.ranks)):
+                count = self.suits * (self.suits - 1) if r1 == r2 else self.suits * self.suits
+                if count:
+                    probs[(r1, r2)] = count / (n * (n - 1))
+        return probs
+
+    def board_probs(self, used):
+        # {rank: probability} of the next board card given the ranks already dealt
+        remaining = len(self.ranks) * self.suits - len(used)
+        probs = {}
+        for r in range(len(self.ranks)):
+            left = self.suits - used.count(r)
+            if left > 0:
+                probs[r] = left / remaining
+        return probs
+
+    def raise_actions(self, r):
+        sizes = self.bets[r]
+        return [('r', sizes[0])] if len(sizes) == 1 else [(f'r{s}', s) for s in sizes]
+
+    def showdown(self, deal, board):
+        # Payoff sign for player 1
+        strength = [(board.count(deal[p]), deal[p]) for p in range(2)]
+        return (strength[0] > strength[1]) - (strength[0] < strength[1])
+
+    def walk(self, deal, board, history, r, contrib, raises, actor, facing, acted):
+        # Yields (history, kind, data) for the subtree of a betting state depth first. deal is
+        # None in the public walk, which then yields the decision points and all board cards
+        # kind is 'player' (data: player index, actions), 'chance' (data: {label: prob}) or
+        # 'terminal' (data: player 1's payoff)
+        label = f'P{actor + 1}'
+        actions = ['c', 'f'] if facing else ['c']
+        raise_actions = self.raise_actions(r) if raises < self.raise_cap else []
+        actions += [name for name, _ in raise_actions]
+        yield history, 'player', (actor, actions)
+
+        other = 1 - actor
+        # Check or call
+        child = f'{history}{label}:c/'
+        new_contrib = list(contrib)
+        new_contrib[actor] = contrib[other]
+        if facing or acted:
+            yield from self.end_round(deal, board, child, r, new_contrib)
+        else:
+            yield from self.walk(deal, board, child, r, new_contrib, raises, other, False, True)
+        # Fold
+        if facing:
+            sign = 1 if actor == 1 else -1
+            yield f'{history}{label}:f/', 'terminal', sign * contrib[actor]
+        # Raise
+        for name, size in raise_actions:
+            new_contrib = list(contrib)
+            new_contrib[actor] = contrib[other] + size
+            yield from self.walk(deal, board, f'{history}{label}:{name}/', r, new_contrib,
+                                 raises + 1, other, True, True)
+
+    def end_round(self, deal, board, history, r, contrib):
+        if r == len(self.bets) - 1:
+            if deal is not None:
+                yield history, 'terminal', self.showdown(deal, board) * contrib[0]
+            else:
+                yield history, 'terminal', None
+            return
+        used = list(board) if deal is None else list(deal) + list(board)
+        probs = self.board_probs(used) if deal is not None else {b: None for b in range(len(self.ranks))}
+        yield history, 'chance', {self.ranks[b]: prob for b, prob in probs.items()}
+        for b in probs:
+            yield from self.walk(deal, board + [b], f'{history}C:{self.ranks[b]}/', r + 1,
+                                 contrib, 0, 0, False, False)
+
+    def start(self, deal):
+        return self.walk(deal, [], f'/C:{self.ranks[deal[0]]}{self.ranks[deal[1]]}/' if deal else '/',
+                         0, [self.ante, self.ante], 0, 0, False, False)
+
+def write_leduc(path, ranks=3, suits=2, bets=(2, 4), raise_cap=2, ante=1):
+    # Write a Leduc style poker game to path, returns the number of nodes written
+    rules = LeducRules(ranks, suits, bets, raise_cap, ante)
+    deals = rules.deal_probs()
+    count = 1
+    with open(path, 'w') as f:
+        actions = ' '.join(f'{rules.ranks[r1]}{rules.ranks[r2]}={format_prob(p)}'
+                           for (r1, r2), p in deals.items())
+        f.write(f'node / chance actions {actions}\n')
+        for deal in deals:
+            for history, kind, data in rules.start(deal):
+                f.write(f'node {history} {node_line(kind, data)}\n')
+                count += 1
+
+        # Info sets: every public decision point for every private rank of the acting player
+        for public, kind, data in rules.start(None):
+            if kind != 'player':
+                continue
+            actor = data[0]
+            board = [rules.ranks.index(t[2:]) for t in public.strip('/').split('/') if t.startswith('C:')]
+            for own in range(len(rules.ranks)):
+                members = []
+                for other in range(len(rules.ranks)):
+                    deal = (own, other) if actor == 0 else (other, own)
+                    if deal in deals and feasible(rules, list(deal), board):
+                        members.append(f'/C:{rules.ranks[deal[0]]}{rules.ranks[deal[1]]}{public}')
+                if members:
+                    masked = rules.ranks[own] + '?' if actor == 0 else '?' + rules.ranks[own]
+                    f.write(f"infoset /C:{masked}{public} nodes {' '.join(members)}\n")
+    return count
+
+def feasible(rules, dealt, board):
+    # Whether the board cards can follow the private cards with the deck's suits
+    for b in board:
+        if dealt.count(b) >= rules.suits:
+            return False
+        dealt.append(b)
+    return True
+
+def node_line(kind, data):
+    if kind == 'player':
+        return f"player {data[0] + 1} actions {' '.join(data[1])}"
+    elif kind == 'chance':
+        return 'chance actions ' + ' '.join(f'{a}={format_prob(p)}' for a, p in data.items())
+    return format_payoffs(data)
+
+### Random extensive form games ###
+
+def public_rng(seed, history):
+    # Random numbers that only depend on the public history, so every member of an info set
+    # sees the same structure
+    return random.Random(f'{seed}{history}')
+
+def write_random(path, depth=6, branching=2, info_set_size=2, terminal_prob=0.0, seed=0):
+    # Random zero sum game: chance deals each player one of info_set_size private types, then
+    # the players alternate for up to depth moves with branching actions each, seeing their
+    # own type and the public history, so every info set has info_set_size nodes. A public
+    # node ends the game early with probability terminal_prob, payoffs are uniform in [-1, 1].
+    # Returns the number of nodes written
+    if info_set_size < 1 or branching < 1 or depth < 0:
+        raise ValueError('info_set_size and branching must be >= 1 and depth >= 0')
+    types = [(t1, t2) for t1 in range(info_set_size) for t2 in range(info_set_size)]
+    payoff_rng = random.Random(seed)
+    actions = [f'a{k}' for k in range(branching)]
+
+    def public_tree(history, moves):
+        # Public decision points as (history, player index), depth first
+        if moves == depth or (moves > 0 and public_rng(seed, history).random() < terminal_prob):
+            return
+        yield history, moves % 2
+        label = f'P{moves % 2 + 1}'
+        for a in actions:
+            yield from public_tree(f'{history}{label}:{a}/', moves + 1)
+
+    def subtree(prefix, history, moves):
+        if moves == depth or (moves > 0 and public_rng(seed, history).random() < terminal_prob):
+            yield f'node {prefix}{history} {format_payoffs(round(payoff_rng.uniform(-1, 1), 4))}\n'
+            return
+        yield f"node {prefix}{history} player {moves % 2 + 1} actions {' '.join(actions)}\n"
+        label = f'P{moves % 2 + 1}'
+        for a in actions:
+            yield from subtree(prefix, f'{history}{label}:{a}/', moves + 1)
+
+    count = 1
+    with open(path, 'w') as f:
+        deal_prob = format_prob(1 / len(types))
+        f.write('node / chance actions ' + ' '.join(f'{t1}-{t2}={deal_prob}' for t1, t2 in types) + '\n')
+        for t1, t2 in types:
+            for line in subtree(f'/C:{t1}-{t2}', '/', 0):
+                f.write(line)
+                count += 1
+        for history, player in public_tree('/', 0):
+            for own in range(info_set_size):
+                if player == 0:
+                    name = f'/C:{own}-?{history}'
+                    members = [f'/C:{own}-{other}{history}' for other in range(info_set_size)]
+                else:
+                    name = f'/C:?-{own}{history}'
+                    members = [f'/C:{other}-{own}{history}' for other in range(info_set_size)]
+                f.write(f"infoset {name} nodes {' '.join(members)}\n")
+    return count
+
+def main():
+    parser = argparse.ArgumentParser(description='Write synthetic games in the game text format')
+    subparsers = parser.add_subparsers(dest='kind', required=True)
+    leduc = subparsers.add_parser('leduc', help='Leduc style poker')
+    leduc.add_argument('path')
+    leduc.add_argument('--ranks', type=int, default=3)
+    leduc.add_argument('--suits', type=int, default=2)
+    leduc.add_argument('--bets', nargs='+', default=['2', '4'],
+                       help='raise size per round, comma separated for several sizes, e.g. 2 4,8')
+    leduc.add_argument('--raise-cap', type=int, default=2)
+    leduc.add_argument('--ante', type=int, default=1)
+    rand = subparsers.add_parser('random', help='random extensive form game')
+    rand.add_argument('path')
+    rand.add_argument('--depth', type=int, default=6)
+    rand.add_argument('--branching', type=int, default=2)
+    rand.add_argument('--info-set-size', type=int, default=2)
+    rand.add_argument('--terminal-prob', type=float, default=0.0)
+    rand.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    if args.kind == 'leduc':
+        bets = [tuple(int(s) for s in b.split(',')) for b in args.bets]
+        count = write_leduc(args.path, args.ranks, args.suits, bets, args.raise_cap, args.ante)
+    else:
+        count = write_random(args.path, args.depth, args.branching, args.info_set_size,
+                             args.terminal_prob, args.seed)
+    print(f'Wrote {count} nodes to {args.path}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,146 @@
+import contextlib
+import signal
+import time
+from collections import Counter, defaultdict
+import numpy as np
+
+### Opt in solver instrumentation ###
+
+# The solvers take metrics=None and only touch a Metrics object when one is passed, so the cost
+# when disabled is an 'is not None' check per node in the recursive traversals and nothing per
+# node in the vectorized ones. Phases: 'traversal', 'regret_update' (the vectorized engines
+# adding a pass's regret and strategy deltas, flooring and discounting), 'floor_discount' (the
+# recursive and sampling engines update the tables inside 'traversal', only flooring and
+# discounting come after it), and cfr_dual's 'averaging' and 'gap'
+
+NODE_TYPES = ['TerminalNode', 'ChanceNode', 'DecisionNode'] # in the order of flat_game's kinds
+NULL_PHASE = contextlib.nullcontext()
+
+def phase(metrics, name):
+    # Timer context for a phase that is a no op without metrics
+    return NULL_PHASE if metrics is None else metrics.phase(name)
+
+class Metrics:
+    # Collects per phase wall clock time, node visits per iteration by node type and info set
+    # touch counts. callback(metrics, iteration) is called after every iteration, and
+    # profile=(first, last) runs the sampling profiler for iterations first to last inclusive
+    def __init__(self, callback=None, profile=None, profile_interval=0.001):
+        self.callback = callback
+        self.phase_seconds = defaultdict(float)
+        self.phase_calls = defaultdict(int)
+        self.visits = dict.fromkeys(NODE_TYPES, 0) # visits of the current iteration
+        self.total_visits = Counter() # visits of all finished iterations
+        self.iterations = 0 # finished iterations
+        self.info_set_touches = Counter()
+        self.iteration = 0
+        self.profile = profile
+        self.profiler = SamplingProfiler(profile_interval) if profile is not None else None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phase_seconds[name] += time.perf_counter() - start
+            self.phase_calls[name] += 1
+
+    def visit(self, node_type, info_set=None):
+        self.visits[node_type] += 1
+        if info_set is not None:
+            self.info_set_touches[info_set] += 1
+
+    def visit_game(self, game):
+        # Visits of a vectorized pass over every node of a FlatGame
+        for node_type, count in zip(NODE_TYPES, np.bincount(game.kind, minlength=len(NODE_TYPES))):
+            self.visits[node_type] += int(count)
+        decisions = game.info_set[game.info_set >= 0]
+        for i, count in enumerate(np.bincount(decisions, minlength=game.num_info_sets).tolist()):
+            self.info_set_touches[game.info_set_names[i]] += count
+
+    def begin_iteration(self, iteration):
+        self.iteration = iteration
+        self.visits = dict.fromkeys(NODE_TYPES, 0)
+        if self.profiler is not None and iteration == self.profile[0]:
+            self.profiler.start()
+
+    def end_iteration(self):
+        self.total_visits.update(self.visits)
+        self.iterations += 1
+        if self.profiler is not None and self.iteration == self.profile[1]:
+            self.profiler.stop()
+        if self.callback is not None:
+            self.callback(self, self.iteration)
+
+    def finish(self):
+        # Stop the profiler if the run ended inside the profiling window
+        if self.profiler is not None:
+            self.profiler.stop()
+
+    def summary(self, top=10):
+        result = {'iterations': self.iterations,
+                  'phases': {name: {'seconds': seconds, 'calls': self.phase_calls[name]}
+                             for name, seconds in self.phase_seconds.items()},
+                  'visits': dict(self.total_visits),
+                  'info_set_touches': dict(self.info_set_touches.most_common(top))}
+        if self.profiler is not None:
+            result['profile'] = dict(self.profiler.samples.most_common(top))
+        return result
+
+    def report(self, top=10):
+        summary = self.summary(top)
+        lines = [f"{summary['iterations']} iterations"]
+        for name, stats in summary['phases'].items():
+            lines.append(f"  {name:16} {stats['seconds']:10.4f}s {stats['calls']:8} calls")
+        iterations = max(summary['iterations'], 1)
+        for node_type, count in summary['visits'].items():
+            lines.append(f'  {node_type:16} {count / iterations:12.1f} visits/iteration')
+        lines.append('  most touched info sets:')
+        for name, count in summary['info_set_touches'].items():
+            lines.append(f'    {count:10} {name}')
+        if 'profile' in summary:
+            lines.append(f'  profile ({self.profiler.total} samples):')
+            for stack, count in summary['profile'].items():
+                lines.append(f'    {count:8} {stack}')
+        return '\n'.join(lines)
+
+### Sampling profiler ###
+
+class SamplingProfiler:
+    # Samples the Python stack every interval seconds of CPU time with SIGPROF and counts the
+    # sampled stacks, collapsed to 'outer;...;inner:line'. Unix only, and like every signal
+    # handler it has to be started from the main thread
+    def __init__(self, interval=0.001, depth=8):
+        if not hasattr(signal, 'SIGPROF'):
+            raise ValueError('The sampling profiler needs SIGPROF, which this platform lacks')
+        self.interval = interval
+        self.depth = depth
+        self.samples = Counter()
+        self.total = 0
+        self.running = False
+        self.previous_handler = None
+
+    def sample(self, signum, frame):
+        # Recursive calls are collapsed into one entry so deep traversals still show their callers
+        names = []
+        line = frame.f_lineno if frame is not None else 0
+        while frame is not None and len(names) < self.depth:
+            if not names or names[-1] != frame.f_code.co_name:
+                names.append(frame.f_code.co_name)
+            frame = frame.f_back
+        self.samples[';'.join(reversed(names)) + f':{line}'] += 1
+        self.total += 1
+
+    def start(self):
+        if self.running:
+            return
+        self.previous_handler = signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+        self.running = True
+
+    def stop(self):
+        if not self.running:
+            return
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, self.previous_handler)
+        self.running = False
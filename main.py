@@ -1,15 +1,23 @@
-from utils import load_game_from_txt
+import argparse
+from utils import load_game_from_txt, set_plot_dir
 from problem_5p1 import find_the_best_response
 from problem_5p2 import learning_to_best_respond
 from problem_5p3 import learning_the_nash_equilibrium
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--plot-dir', help='write the graphs to this directory instead of showing them')
+    args = parser.parse_args()
+    set_plot_dir(args.plot_dir)
+
     games = [
         ('Rock Paper Superscissors', './rock_paper_superscissors.txt'),
         ('Kuhn Poker', './kuhn.txt'),
         ('Leduc Poker', './leduc2.txt')
     ]
 
+    # The problems run one game at a time because 5.1 and 5.2 show their graphs as they go,
+    # grids of cfr_dual solves run in parallel with sweep.py
     for game_name, filename in games:
         # Construct the game tree
         print(game_name)
@@ -0,0 +1,211 @@
+import random
+from problem_5p2 import regret_matching, normalize, init_tables
+from cfr_variants import floor_rows, discount_rows
+from instrumentation import phase
+
+SAMPLERS = ['chance', 'external', 'outcome']
+
+def sample_action(probs, rng):
+    # Sample a key of a {action: probability} dict
+    r = rng.random()
+    total = 0.0
+    for a, prob in probs.items():
+        total += prob
+        if r < total:
+            return a
+    # Guard against probabilities summing to slightly less than one
+    return a
+
+### Sampled CFR traversals ###
+
+def chance_sampled_utility(tree, regrets, strategy_sum, rng, rprob1=1.0, rprob2=1.0,
+                           update_player=None, metrics=None):
+    # cfr_utility_dual with one sampled outcome per chance node, the sampling probability
+    # cancels the chance reach so reach probabilities only include the players' actions
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
+    if tree.type == 'TerminalNode':
+        return tree.node.payoffs
+    elif tree.type == 'DecisionNode':
+        player = tree.node.player
+        info_set = tree.info_set
+
+        # Compute strategy for this player
+        strategy = regret_matching(regrets[info_set])
+        update = update_player is None or update_player == player
+        if update:
+            for a in tree.children:
+                strategy_sum[info_set][a] += (rprob1 if player == '1' else rprob2) * strategy[a]
+
+        # Compute expected utility for each action
+        action_utils = {}
+        node_value = {'1': 0.0, '2': 0.0}
+        for a, child_node in tree.children.items():
+            next_rprob1 = rprob1 * strategy[a] if player == '1' else rprob1
+            next_rprob2 = rprob2 * strategy[a] if player == '2' else rprob2
+            child_util = chance_sampled_utility(child_node, regrets, strategy_sum, rng,
+                                                next_rprob1, next_rprob2, update_player, metrics)
+            action_utils[a] = child_util
+            node_value['1'] += strategy[a] * child_util['1']
+            node_value['2'] += strategy[a] * child_util['2']
+
+        # Update regrets for this player
+        if update:
+            opp_rprob = rprob2 if player == '1' else rprob1
+            for a in tree.children:
+                regrets[info_set][a] += opp_rprob * (action_utils[a][player] - node_value[player])
+
+        return node_value
+    elif tree.type == 'ChanceNode':
+        a = sample_action(tree.node.probs, rng)
+        return chance_sampled_utility(tree.children[a], regrets, strategy_sum, rng,
+                                      rprob1, rprob2, update_player, metrics)
+    else:
+        raise Exception("Unknown node type")
+
+def external_sampling_utility(tree, regrets, strategy_sum, player, rng, metrics=None):
+    # The traversing player explores all of their actions, chance and the opponent are sampled
+    # and the opponent's sampled strategies are added to the strategy sum
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
+    if tree.type == 'TerminalNode':
+        return tree.node.payoffs[player]
+    elif tree.type == 'ChanceNode':
+        a = sample_action(tree.node.probs, rng)
+        return external_sampling_utility(tree.children[a], regrets, strategy_sum, player, rng, metrics)
+    elif tree.type == 'DecisionNode':
+        info_set = tree.info_set
+        strategy = regret_matching(regrets[info_set])
+        if tree.node.player == player:
+            action_utils = {}
+            node_value = 0.0
+            for a, child_node in tree.children.items():
+                action_utils[a] = external_sampling_utility(child_node, regrets, strategy_sum, player, rng, metrics)
+                node_value += strategy[a] * action_utils[a]
+            for a in tree.children:
+                regrets[info_set][a] += action_utils[a] - node_value
+            return node_value
+        else:
+            for a in tree.children:
+                strategy_sum[info_set][a] += strategy[a]
+            a = sample_action(strategy, rng)
+            return external_sampling_utility(tree.children[a], regrets, strategy_sum, player, rng, metrics)
+    else:
+        raise Exception("Unknown node type")
+
+def outcome_sampling_utility(tree, regrets, strategy_sum, player, rng, epsilon,
+                             my_reach=1.0, opp_reach=1.0, sample_reach=1.0, metrics=None):
+    # Samples a single trajectory, the traversing player explores with probability epsilon and
+    # every update is importance weighted by the probability of sampling the trajectory. Chance
+    # is folded into opp_reach, returns the sampled estimate of the traversing player's value
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
+    if tree.type == 'TerminalNode':
+        return tree.node.payoffs[player]
+    elif tree.type == 'ChanceNode':
+        a = sample_action(tree.node.probs, rng)
+        prob = tree.node.probs[a]
+        return outcome_sampling_utility(tree.children[a], regrets, strategy_sum, player, rng, epsilon,
+                                        my_reach, opp_reach * prob, sample_reach * prob, metrics)
+    elif tree.type == 'DecisionNode':
+        info_set = tree.info_set
+        strategy = regret_matching(regrets[info_set])
+        own = tree.node.player == player
+        if own:
+            uniform = 1.0 / len(strategy)
+            sample_strategy = {a: epsilon * uniform + (1 - epsilon) * prob for a, prob in strategy.items()}
+        else:
+            sample_strategy = strategy
+
+        # Follow one sampled action
+        sampled = sample_action(sample_strategy, rng)
+        next_my_reach = my_reach * strategy[sampled] if own else my_reach
+        next_opp_reach = opp_reach if own else opp_reach * strategy[sampled]
+        child_value = outcome_sampling_utility(tree.children[sampled], regrets, strategy_sum, player,
+                                               rng, epsilon, next_my_reach, next_opp_reach,
+                                               sample_reach * sample_strategy[sampled], metrics)
+
+        # Importance weighted value estimates for every action
+        action_utils = {a: 0.0 for a in strategy}
+        action_utils[sampled] = child_value / sample_strategy[sampled]
+        node_value = sum(strategy[a] * action_utils[a] for a in strategy)
+
+        if own:
+            weight = opp_reach / sample_reach
+            for a in strategy:
+                regrets[info_set][a] += weight * (action_utils[a] - node_value)
+        else:
+            # The acting opponent's own reach is opp_reach from the traverser's point of view
+            for a in strategy:
+                strategy_sum[info_set][a] += opp_reach * strategy[a] / sample_reach
+        return node_value
+    else:
+        raise Exception("Unknown node type")
+
+### Monte Carlo CFR engine ###
+
+class SamplingEngine:
+    # Same interface as the engines in problem_5p3, with sampler one of SAMPLERS and a seedable
+    # random number generator. iterate() returns sampled estimates of the root utilities
+    def __init__(self, tree, info_sets, variant, sampler, seed=None, epsilon=0.6):
+        if sampler not in SAMPLERS:
+            raise ValueError(f'Unknown sampler {sampler}, expected one of {SAMPLERS}')
+        self.tree = tree
+        self.info_sets = info_sets
+        self.variant = variant
+        self.sampler = sampler
+        self.epsilon = epsilon
+        self.rng = random.Random(seed)
+        self.iteration = 0
+        self.metrics = None
+        self.regrets, self.strategy_sum = init_tables(info_sets)
+
+    def iterate(self):
+        self.iteration += 1
+        if self.sampler == 'chance':
+            util = {'1': 0.0, '2': 0.0}
+            for update_player in (['1', '2'] if self.variant.alternating else [None]):
+                with phase(self.metrics, 'traversal'):
+                    util = chance_sampled_utility(self.tree, self.regrets, self.strategy_sum, self.rng,
+                                                  update_player=update_player, metrics=self.metrics)
+                self.after_update()
+            util = (util['1'], util['2'])
+        else:
+            # Sampling schemes that traverse for one player at a time alternate every iteration
+            util = []
+            for player in ['1', '2']:
+                with phase(self.metrics, 'traversal'):
+                    if self.sampler == 'external':
+                        util.append(external_sampling_utility(self.tree, self.regrets, self.strategy_sum,
+                                                              player, self.rng, self.metrics))
+                    else:
+                        util.append(outcome_sampling_utility(self.tree, self.regrets, self.strategy_sum,
+                                                             player, self.rng, self.epsilon,
+                                                             metrics=self.metrics))
+                self.after_update()
+            util = tuple(util)
+        with phase(self.metrics, 'floor_discount'):
+            discount_rows(self.variant, self.regrets.values(), self.strategy_sum.values(), self.iteration)
+        return util
+
+    def after_update(self):
+        with phase(self.metrics, 'floor_discount'):
+            if self.variant.floor_regrets:
+                floor_rows(self.regrets.values())
+
+    def average_strategy(self):
+        return {info_set_name: normalize(self.strategy_sum[info_set_name])
+                for info_set_name in self.strategy_sum}
+
+    def average_table(self, game):
+        return game.dict_to_table(self.average_strategy())
+
+    def regret_dict(self):
+        return self.regrets
+
+    def get_tables(self, game):
+        return game.dict_to_table(self.regrets), game.dict_to_table(self.strategy_sum)
+
+    def set_tables(self, game, regrets, strategy_sum):
+        game.fill_dict(self.regrets, regrets)
+        game.fill_dict(self.strategy_sum, strategy_sum)
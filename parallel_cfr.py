@@ -0,0 +1,185 @@
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+from utils import ChanceNode, TreeNode
+from flat_game import compile_game
+from vectorized_cfr import VectorizedCFR, regret_matching_table, normalize_table
+from cfr_variants import floor_table, discount_table
+from instrumentation import phase
+
+### Splitting the tree under the root chance node ###
+
+def shard_root(tree, num_shards):
+    # Split the children of the root chance node into at most num_shards contiguous groups,
+    # each returned as a chance node over its group with the original (unnormalized)
+    # probabilities so the shards' values sum to the value of the whole tree
+    if tree.type != 'ChanceNode':
+        raise ValueError('Parallel CFR needs the root of the game to be a chance node')
+    actions = list(tree.children)
+    num_shards = max(1, min(num_shards, len(actions)))
+    bounds = np.linspace(0, len(actions), num_shards + 1).round().astype(int)
+    shards = []
+    for k in range(num_shards):
+        group = actions[bounds[k]:bounds[k+1]]
+        shard = TreeNode(ChanceNode({a: tree.node.probs[a] for a in group}))
+        for a in group:
+            # Only the shard points at the original subtrees, their parents are left untouched
+            shard.set_child(a, tree.children[a])
+        shards.append(shard)
+    return shards
+
+### Worker processes ###
+
+def attach(name, shape):
+    block = shared_memory.SharedMemory(name=name)
+    return block, np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+
+def worker_loop(game, index, names, table_shape, num_workers, conn):
+    # Each worker owns one shard, reads the current strategy from shared memory and writes its
+    # regret/strategy sum increments and root utilities into its own slot of the shared arrays
+    passes = VectorizedCFR(game)
+    blocks = []
+    block, strategy = attach(names['strategy'], table_shape)
+    blocks.append(block)
+    block, regret_delta = attach(names['regret_delta'], (num_workers,) + table_shape)
+    blocks.append(block)
+    block, strategy_delta = attach(names['strategy_delta'], (num_workers,) + table_shape)
+    blocks.append(block)
+    block, utils = attach(names['utils'], (num_workers, 2))
+    blocks.append(block)
+    try:
+        while True:
+            command = conn.recv()
+            if command == 'stop':
+                break
+            util, regret_delta[index], strategy_delta[index] = passes.cfr_pass(strategy, command)
+            utils[index] = util
+            conn.send('done')
+    finally:
+        del strategy, regret_delta, strategy_delta, utils
+        for block in blocks:
+            block.close()
+
+### Parallel engine ###
+
+class ParallelEngine:
+    # VectorizedEngine with each CFR pass split over worker processes by root chance outcome.
+    # Increments are summed in worker order so runs are deterministic, and match the single
+    # process vectorized engine up to floating point summation order.
+    # Every pass is a round trip to all workers, as the next strategy needs the merged regrets
+    # of the last one, and costs about 0.15 ms per worker on top of the pass itself. It only
+    # pays off with a free core per worker on games where a single process iteration takes
+    # many milliseconds, i.e. from around 10^5 nodes, and is slower on the bundled games
+    def __init__(self, tree, info_sets, game, variant, workers):
+        self.game = game
+        self.variant = variant
+        self.iteration = 0
+        self.metrics = None
+        self.regrets = game.zeros()
+        self.strategy_sum = game.zeros()
+
+        shard_games = []
+        for shard in shard_root(tree, workers):
+            shard_game = compile_game(shard, info_sets)
+            shard_game.nodes = None # don't ship tree nodes to the workers
+            shard_games.append(shard_game)
+        num_workers = len(shard_games)
+        table_shape = self.regrets.shape
+
+        # Shared arrays, the strategy written by this process and one slot per worker for results
+        self.blocks = {}
+        self.arrays = {}
+        for name, shape in [('strategy', table_shape), ('regret_delta', (num_workers,) + table_shape),
+                            ('strategy_delta', (num_workers,) + table_shape), ('utils', (num_workers, 2))]:
+            block = shared_memory.SharedMemory(create=True, size=max(8, int(np.prod(shape)) * 8))
+            self.blocks[name] = block
+            self.arrays[name] = np.ndarray(shape, dtype=np.float64, buffer=block.buf)
+        names = {name: block.name for name, block in self.blocks.items()}
+
+        self.connections = []
+        self.processes = []
+        for index, shard_game in enumerate(shard_games):
+            parent_conn, child_conn = multiprocessing.Pipe()
+            process = multiprocessing.Process(target=worker_loop, daemon=True,
+                                              args=(shard_game, index, names, table_shape,
+                                                    num_workers, child_conn))
+            process.start()
+            # Only the worker holds the child end, so a dead worker makes recv raise EOFError
+            child_conn.close()
+            self.connections.append(parent_conn)
+            self.processes.append(process)
+
+    def cfr_pass(self, strategy, update_player=None):
+        self.arrays['strategy'][:] = strategy
+        try:
+            for conn in self.connections:
+                conn.send(update_player)
+            for conn in self.connections:
+                conn.recv()
+        except (EOFError, OSError):
+            raise RuntimeError('A parallel CFR worker process died') from None
+        # Merge the shards in a fixed order
+        regret_delta = self.arrays['regret_delta'][0].copy()
+        strategy_delta = self.arrays['strategy_delta'][0].copy()
+        for k in range(1, len(self.connections)):
+            regret_delta += self.arrays['regret_delta'][k]
+            strategy_delta += self.arrays['strategy_delta'][k]
+        util = self.arrays['utils'].sum(axis=0)
+        return util, regret_delta, strategy_delta
+
+    def iterate(self):
+        self.iteration += 1
+        for update_player in ([0, 1] if self.variant.alternating else [None]):
+            with phase(self.metrics, 'traversal'):
+                strategy = regret_matching_table(self.game, self.regrets)
+                util, regret_delta, strategy_delta = self.cfr_pass(strategy, update_player)
+            with phase(self.metrics, 'regret_update'):
+                self.regrets += regret_delta
+                self.strategy_sum += strategy_delta
+                if self.variant.floor_regrets:
+                    floor_table(self.regrets)
+            if self.metrics is not None:
+                self.metrics.visit_game(self.game)
+        with phase(self.metrics, 'regret_update'):
+            discount_table(self.variant, self.regrets, self.strategy_sum, self.iteration)
+        return float(util[0]), float(util[1])
+
+    def average_strategy(self):
+        return self.game.table_to_dict(self.average_table(self.game))
+
+    def average_table(self, game):
+        return normalize_table(self.game, self.strategy_sum)
+
+    def regret_dict(self):
+        return self.game.table_to_dict(self.regrets)
+
+    def get_tables(self, game):
+        return self.regrets.copy(), self.strategy_sum.copy()
+
+    def set_tables(self, game, regrets, strategy_sum):
+        self.regrets[:] = regrets
+        self.strategy_sum[:] = strategy_sum
+
+    def close(self, timeout=5.0):
+        # Stop the workers, the ones that died or don't stop within timeout are terminated
+        for conn in self.connections:
+            try:
+                conn.send('stop')
+            except OSError:
+                pass
+            conn.close()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join(timeout)
+            if process.is_alive():
+                process.kill()
+                process.join()
+        self.arrays = {}
+        for block in self.blocks.values():
+            block.close()
+            block.unlink()
+        self.blocks = {}
+        self.connections = []
+        self.processes = []
@@ -0,0 +1,110 @@
+import atexit
+import multiprocessing
+import os
+import re
+import numpy as np
+
+### Downsampling long series ###
+
+MAX_POINTS = 4000
+
+def minmax_downsample(values, max_points=MAX_POINTS):
+    # (x, y) of at most max_points points keeping the minimum and maximum of each of
+    # max_points / 2 equal buckets in order, so spikes and the envelope of the curve survive
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    x = np.arange(n)
+    if n <= max_points:
+        return x, values
+    edges = np.linspace(0, n, max_points // 2 + 1).astype(np.int64)
+    keep = []
+    for start, end in zip(edges[:-1], edges[1:]):
+        bucket = values[start:end]
+        low, high = start + int(np.argmin(bucket)), start + int(np.argmax(bucket))
+        keep.extend(sorted({low, high}))
+    keep = np.array(keep)
+    return x[keep], values[keep]
+
+def log_downsample(values, max_points=MAX_POINTS):
+    # (x, y) at about max_points log spaced iterations, for curves plotted on a log x axis
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n), values
+    keep = np.unique(np.geomspace(1, n, max_points).astype(np.int64) - 1)
+    return keep, values[keep]
+
+DOWNSAMPLERS = {'minmax': minmax_downsample, 'log': log_downsample}
+
+### Rendering figures to files ###
+
+def plot_filename(metric_name, game_name):
+    slug = lambda s: re.sub(r'[^a-z0-9]+', '_', s.lower()).strip('_')
+    return f'{slug(metric_name)}_{slug(game_name)}.png'
+
+def render(path, x, y, metric_name, game_name, log_x=False):
+    # Runs in the plotting process with the non interactive Agg backend
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fig, ax = plt.subplots()
+    ax.plot(x, y)
+    if log_x:
+        ax.set_xscale('symlog')
+    ax.set_title(f'CFR Player 1 {metric_name} in {game_name}')
+    ax.set_xlabel('Iterations')
+    ax.set_ylabel(metric_name)
+    ax.grid(True)
+    fig.savefig(path)
+    plt.close(fig)
+
+def render_loop(queue):
+    while True:
+        job = queue.get()
+        if job is None:
+            break
+        render(*job)
+
+class PlotWriter:
+    # Renders figures to PNG files in a background process so solvers never wait on
+    # matplotlib, series are downsampled before they are sent to the process
+    def __init__(self):
+        self.queue = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=render_loop, args=(self.queue,), daemon=True)
+        self.process.start()
+
+    def submit(self, path, values, metric_name, game_name, downsample='minmax',
+               max_points=MAX_POINTS):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        x, y = DOWNSAMPLERS[downsample](values, max_points)
+        self.queue.put((path, x, y, metric_name, game_name, downsample == 'log'))
+
+    def close(self):
+        # Wait for the queued figures to be written
+        if self.process is None:
+            return
+        if self.process.is_alive():
+            self.queue.put(None)
+            self.process.join()
+        else:
+            # Don't block exiting on figures nobody will read
+            self.queue.cancel_join_thread()
+        self.process = None
+
+_writer = None
+
+def plot_writer():
+    # Shared writer, started on first use and flushed at exit
+    global _writer
+    if _writer is None:
+        _writer = PlotWriter()
+        atexit.register(_writer.close)
+    return _writer
+
+def save_plot(values, metric_name, game_name, directory, downsample='minmax', max_points=MAX_POINTS):
+    # Queue a plot of values to directory/<metric>_<game>.png, returns the file path
+    path = os.path.join(directory, plot_filename(metric_name, game_name))
+    plot_writer().submit(path, values, metric_name, game_name, downsample, max_points)
+    return path
@@ -0,0 +1,233 @@
+import argparse
+import asyncio
+import json
+import os
+import numpy as np
+from checkpoint import load_checkpoint
+
+### Compiled policy tables ###
+
+# An average strategy compiled for serving. Layout like game_cache: MAGIC, the header length as
+# 8 little endian bytes, a JSON header with the action label table, metadata and every array
+# (dtype, shape, offset), then the raw arrays at 64 byte aligned offsets so they are memory
+# mapped in place. The arrays are
+#   names      the info set names as utf-8 fixed width bytes, sorted, the index searched
+#   row_start  start of every info set's row in the flat arrays, plus the end of the last row
+#   action     index into the action label table of every entry
+#   prob       probability of every entry
+#   cdf        cumulative probability within the row plus the row's index, so every row lives in
+#              (row, row + 1] and a whole batch is sampled with one searchsorted
+
+MAGIC = b'POLICYTABLE1\n'
+ALIGNMENT = 64
+MAX_REQUEST_BYTES = 1 << 26
+ARRAYS = ['names', 'row_start', 'action', 'prob', 'cdf']
+
+def write_policy(path, strategy, meta=None):
+    # Write a strategy ({info set name: {action: prob}}, e.g. cfr_dual's avg_strategy) as a
+    # policy table, meta is an optional JSON serializable dict stored in the header
+    if not strategy:
+        raise ValueError('The strategy has no info sets')
+    encoded = sorted((name.encode('utf-8'), name) for name in strategy)
+    labels = []
+    label_index = {}
+    row_start = [0]
+    action = []
+    prob = []
+    cdf = []
+    for row, (_, name) in enumerate(encoded):
+        total = 0.0
+        for a, p in strategy[name].items():
+            if a not in label_index:
+                label_index[a] = len(labels)
+                labels.append(a)
+            action.append(label_index[a])
+            prob.append(p)
+            total += p
+            cdf.append(row + total)
+        if total <= 0:
+            raise ValueError(f'The probabilities of info set {name} sum to {total}')
+        # Rows are renormalized in the cdf so rounding never leaves a gap at the end of a row
+        cdf[row_start[-1]:] = [row + (c - row) / total for c in cdf[row_start[-1]:]]
+        cdf[-1] = row + 1.0
+        row_start.append(len(action))
+    arrays = {'names': np.array([e for e, _ in encoded], dtype=np.bytes_),
+              'row_start': np.array(row_start, dtype=np.int64),
+              'action': np.array(action, dtype=np.int32),
+              'prob': np.array(prob, dtype=np.float64),
+              'cdf': np.array(cdf, dtype=np.float64)}
+
+    header = {'actions': labels, 'meta': meta or {}, 'arrays': {}}
+    offset = 0
+    for name, array in arrays.items():
+        header['arrays'][name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+    header_bytes = json.dumps(header).encode('utf-8')
+    data_start = -(-(len(MAGIC) + 8 + len(header_bytes)) // ALIGNMENT) * ALIGNMENT
+
+    # Write to a temporary file and rename so a running server never maps a partial table
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(8, 'little'))
+        f.write(header_bytes)
+        for name, array in arrays.items():
+            f.seek(data_start + header['arrays'][name]['offset'])
+            f.write(array.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp_path, path)
+    return path
+
+def checkpoint_strategy(checkpoint):
+    # Average strategy of a solver checkpoint, uniform where all counts are zero
+    strategy = {}
+    for name, actions, counts in zip(checkpoint.info_set_names, checkpoint.info_set_actions,
+                                     checkpoint.strategy_sum):
+        counts = counts[:len(actions)]
+        total = counts.sum()
+        probs = counts / total if total > 0 else np.full(len(actions), 1.0 / len(actions))
+        strategy[name] = dict(zip(actions, probs.tolist()))
+    return strategy
+
+class PolicyTable:
+    # Memory mapped policy table. Batched methods take a list of info set names and return
+    # None for the names that aren't in the table
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{path} is not a policy table')
+            length = int.from_bytes(f.read(8), 'little')
+            header = json.loads(f.read(length).decode('utf-8'))
+        data_start = -(-(len(MAGIC) + 8 + length) // ALIGNMENT) * ALIGNMENT
+        for name in ARRAYS:
+            spec = header['arrays'][name]
+            setattr(self, name, np.memmap(path, dtype=spec['dtype'], mode='r',
+                                          offset=data_start + spec['offset'], shape=tuple(spec['shape'])))
+        self.actions = header['actions']
+        self.action_labels = np.array(self.actions, dtype=object)
+        self.meta = header['meta']
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return self.lookup([name])[0] >= 0
+
+    def lookup(self, names):
+        # Row of every name, -1 for missing names
+        try:
+            queries = np.array(names, dtype=np.bytes_)
+        except UnicodeEncodeError:
+            queries = np.array([name.encode('utf-8') for name in names], dtype=np.bytes_)
+        if len(queries) == 0:
+            return np.zeros(0, dtype=np.int64)
+        rows = np.minimum(np.searchsorted(self.names, queries), len(self.names) - 1)
+        return np.where(self.names[rows] == queries, rows, -1)
+
+    def strategies(self, names):
+        # {action: prob} of every name
+        rows = self.lookup(names)
+        found = rows[rows >= 0]
+        # Gather the entries of all found rows at once, then cut them into dicts
+        starts, ends = self.row_start[found], self.row_start[found + 1]
+        counts = ends - starts
+        offsets = np.cumsum(counts) - counts
+        entries = np.repeat(starts - offsets, counts) + np.arange(counts.sum())
+        actions = self.action_labels[self.action[entries]].tolist()
+        probs = self.prob[entries].tolist()
+        result = [None] * len(rows)
+        for k, offset, count in zip(np.flatnonzero(rows >= 0).tolist(), offsets.tolist(), counts.tolist()):
+            result[k] = dict(zip(actions[offset:offset + count], probs[offset:offset + count]))
+        return result
+
+    def sample(self, names, rng=None):
+        # An action sampled from the strategy of every name, rng is a numpy Generator
+        rng = np.random.default_rng() if rng is None else rng
+        rows = self.lookup(names)
+        found = rows >= 0
+        rows = rows[found]
+        # Every row's cdf lies in (row, row + 1], clamping guards the rounding at row edges
+        entries = np.searchsorted(self.cdf, rows + rng.random(len(rows)), side='right')
+        entries = np.clip(entries, self.row_start[rows], self.row_start[rows + 1] - 1)
+        result = np.full(len(found), None, dtype=object)
+        result[found] = self.action_labels[self.action[entries]]
+        return result.tolist()
+
+### Batch query server ###
+
+# JSON lines over TCP, one request per line answered by one response line carrying the same
+# 'id'. A request holds 'sample' and/or 'strategy', each a list of info set names, and
+# optionally a 'seed' for its samples. The response holds 'actions' (a sampled action per
+# name) and/or 'strategies' ({action: prob} per name), null for unknown names, or 'error'
+
+def info_set_names(request, key):
+    names = request[key]
+    if not isinstance(names, list) or not all(isinstance(name, str) for name in names):
+        raise ValueError(f"'{key}' must be a list of info set names")
+    return names
+
+def answer(table, request, rng):
+    if not isinstance(request, dict):
+        raise ValueError('A request must be a JSON object')
+    response = {'id': request.get('id')}
+    if 'seed' in request:
+        rng = np.random.default_rng(request['seed'])
+    if 'sample' in request:
+        response['actions'] = table.sample(info_set_names(request, 'sample'), rng)
+    if 'strategy' in request:
+        response['strategies'] = table.strategies(info_set_names(request, 'strategy'))
+    return response
+
+async def handle_connection(table, reader, writer, rng):
+    try:
+        while line := await reader.readline():
+            try:
+                response = answer(table, json.loads(line), rng)
+            except (ValueError, TypeError) as e:
+                response = {'error': str(e)}
+            writer.write(json.dumps(response).encode('utf-8') + b'\n')
+            await writer.drain()
+    except (ConnectionError, ValueError):
+        # Dropped connections and request lines over MAX_REQUEST_BYTES end the connection
+        pass
+    finally:
+        writer.close()
+
+async def serve(path, host='127.0.0.1', port=8765, seed=None):
+    # Serve the policy table at path until cancelled, only numpy and the table are loaded
+    table = PolicyTable(path)
+    rng = np.random.default_rng(seed)
+    server = await asyncio.start_server(
+        lambda reader, writer: handle_connection(table, reader, writer, rng), host, port,
+        limit=MAX_REQUEST_BYTES)
+    addresses = ', '.join(str(sock.getsockname()) for sock in server.sockets)
+    print(f'Serving {len(table)} info sets from {path} on {addresses}')
+    async with server:
+        await server.serve_forever()
+
+def main():
+    parser = argparse.ArgumentParser(description='Export and serve compiled policy tables')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    export = subparsers.add_parser('export', help="write a checkpoint's average strategy as a policy table")
+    export.add_argument('checkpoint')
+    export.add_argument('output')
+    server = subparsers.add_parser('serve', help='answer batched JSON lines queries over TCP')
+    server.add_argument('policy')
+    server.add_argument('--host', default='127.0.0.1')
+    server.add_argument('--port', type=int, default=8765)
+    server.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'export':
+        checkpoint = load_checkpoint(args.checkpoint)
+        meta = {'iteration': checkpoint.iteration, 'variant': checkpoint.variant}
+        write_policy(args.output, checkpoint_strategy(checkpoint), meta)
+        print(f'Wrote {len(checkpoint.info_set_names)} info sets to {args.output}')
+    else:
+        try:
+            asyncio.run(serve(args.policy, args.host, args.port, args.seed))
+        except KeyboardInterrupt:
+            pass
+
+if __name__ == '__main__':
+    main()
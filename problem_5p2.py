@@ -1,4 +1,10 @@
+import time
 from utils import get_player_from_info_set, graph_output
+from convergence import make_schedule, open_log
+from cfr_variants import Variant, make_variant, floor_rows, discount_rows
+from flat_game import compile_game
+from checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint, warm_start_tables
+from instrumentation import phase
 
 def normalize(strategy_counts):
     total = sum(strategy_counts.values())
@@ -17,7 +23,18 @@ def regret_matching(regret_map):
     n = len(regret_map)
     return {a: 1.0 / n for a in regret_map}
 
-def cfr_utility(tree, info_sets, player, rprob1, rprob2, regrets, strategy_sum):
+def regret_matching_row(regret_row):
+    # Same as regret_matching for a list of regrets indexed by action position
+    positive_regrets = [r if r > 0 else 0.0 for r in regret_row]
+    normalizer = sum(positive_regrets)
+    if normalizer > 0:
+        return [r / normalizer for r in positive_regrets]
+    n = len(regret_row)
+    return [1.0 / n] * n
+
+def cfr_utility(tree, info_sets, player, rprob1, rprob2, regrets, strategy_sum, metrics=None):
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
     # Base case
     if tree.type == 'TerminalNode':
         # Return payoff of player
@@ -36,7 +53,7 @@ def cfr_utility(tree, info_sets, player, rprob1, rprob2, regrets, strategy_sum):
         action_utils = {}
         node_value = 0
         for a, child_node in tree.children.items():
-            action_utils[a] = cfr_utility(child_node, info_sets, player, rprob1 * strategy[a], rprob2, regrets, strategy_sum)
+            action_utils[a] = cfr_utility(child_node, info_sets, player, rprob1 * strategy[a], rprob2, regrets, strategy_sum, metrics)
             node_value += strategy[a] * action_utils[a]
 
         # Update regrets
@@ -59,39 +76,125 @@ def cfr_utility(tree, info_sets, player, rprob1, rprob2, regrets, strategy_sum):
             else:
                 prob = uniform_strategy
                 adj = prob
-            expected_payoff = cfr_utility(child_node, info_sets, player, rprob1, adj * rprob2, regrets, strategy_sum)
+            expected_payoff = cfr_utility(child_node, info_sets, player, rprob1, adj * rprob2, regrets, strategy_sum, metrics)
             total_expected_payoff += expected_payoff * prob
         return total_expected_payoff
     else:
         # Shouldn't happen
         raise Exception
 
-def cfr(tree, info_sets, player, iters=1000):
-    # Setup the regret and strategy sum
+def init_tables(info_sets, player=None):
+    # Zero regret and strategy sum tables {info set: {action: value}} for the info sets of
+    # player, or of both players if player is None
     regrets = {}
     strategy_sum = {}
     for info_set_name in info_sets.get_info_sets():
-        player_name = get_player_from_info_set(info_set_name, info_sets)
-        if player_name == player:
-            nodes = info_sets.get_info_set(info_set_name)
-            actions = set()
-            for node in nodes:
-                if node.type == 'DecisionNode':
-                    actions.update(node.node.actions)
-            regrets[info_set_name] = {a: 0 for a in actions}
-            strategy_sum[info_set_name] = {a: 0 for a in actions}
+        if player is not None and get_player_from_info_set(info_set_name, info_sets) != player:
+            continue
+        nodes = info_sets.get_info_set(info_set_name)
+        actions = set()
+        for node in nodes:
+            if node.type == 'DecisionNode':
+                actions.update(node.node.actions)
+        regrets[info_set_name] = {a: 0 for a in actions}
+        strategy_sum[info_set_name] = {a: 0 for a in actions}
+    return regrets, strategy_sum
+
+class LearnerTables:
+    # The regret and strategy sum tables of cfr's learning player in init_tables' layout, with
+    # the get_tables/set_tables interface of the problem_5p3 engines so they go through the
+    # checkpoint functions. The other player's rows of the dense tables are zero
+    def __init__(self, info_sets, player, variant):
+        self.regrets, self.strategy_sum = init_tables(info_sets, player)
+        self.variant = variant
+        self.iteration = 0
+
+    def get_tables(self, game):
+        return game.dict_to_table(self.regrets), game.dict_to_table(self.strategy_sum)
+
+    def set_tables(self, game, regrets, strategy_sum):
+        game.fill_dict(self.regrets, regrets)
+        game.fill_dict(self.strategy_sum, strategy_sum)
+
+def cfr(tree, info_sets, player, iters=1000, schedule=None, log=None, variant=None,
+        metrics=None, checkpoint=None, checkpoint_every=None, resume=None, warm_start=None,
+        warm_start_iters=100, return_iterations=False):
+    # schedule picks the iterations whose utility is recorded (every iteration by default, see
+    # convergence.make_schedule). Records are streamed to log (a .jsonl/.csv path or
+    # ConvergenceLog) if given, and otherwise collected in the returned utilities list.
+    # return_iterations appends the list of the iterations the utilities were recorded at to the
+    # returned tuple.
+    # variant selects the update rule as in problem_5p3.cfr_dual, alternating updates do not
+    # apply with a single learning player. metrics (an instrumentation.Metrics) records phase
+    # timings, node visits and info set touches. checkpoint, checkpoint_every, resume,
+    # warm_start and warm_start_iters work as in cfr_dual, only the learning player's tables are
+    # saved and restored
+
+    # Setup the regret and strategy sum
+    game = None
+    if checkpoint is not None or resume is not None or warm_start is not None:
+        game = compile_game(tree, info_sets)
+    engine = f'cfr:{player}' # checkpoints of cfr only resume cfr for the same player
+    state = None
+    if resume is not None:
+        state = load_checkpoint(resume)
+        if state.engine != engine:
+            raise ValueError(f'Checkpoint was saved by {state.engine}, not {engine}')
+        if variant is None:
+            variant = Variant(**state.variant)
+    tables = LearnerTables(info_sets, player, make_variant(variant))
+    if state is not None:
+        restore_checkpoint(state, game, tables)
+    elif warm_start is not None:
+        tables.set_tables(game, *warm_start_tables(game, warm_start, warm_start_iters))
+    regrets, strategy_sum, variant = tables.regrets, tables.strategy_sum, tables.variant
 
     # Repeatedly run CFR up to the # iters
+    schedule = make_schedule(schedule)
     utilities = []
-    for i in range(iters):
-        player_expected_utility = cfr_utility(tree, info_sets, player, 1.0, 1.0, regrets, strategy_sum)
-        utilities.append(player_expected_utility)
-    
-    # Compute the average strategy
-    avg_strategy = {}
-    for info_set_name in strategy_sum:
-        avg_strategy[info_set_name] = normalize(strategy_sum[info_set_name])
+    iterations = []
+    try:
+        with open_log(log, append=resume is not None) as metrics_log:
+            first = tables.iteration
+            start = time.perf_counter()
+            for i in range(first + 1, iters + 1):
+                if metrics is not None:
+                    metrics.begin_iteration(i)
+                with phase(metrics, 'traversal'):
+                    player_expected_utility = cfr_utility(tree, info_sets, player, 1.0, 1.0, regrets,
+                                                          strategy_sum, metrics)
+                with phase(metrics, 'floor_discount'):
+                    if variant.floor_regrets:
+                        floor_rows(regrets.values())
+                    discount_rows(variant, regrets.values(), strategy_sum.values(), i)
+                tables.iteration = i
+                if checkpoint is not None and checkpoint_every and i % checkpoint_every == 0:
+                    save_checkpoint(checkpoint, game, tables, engine)
+                if metrics is not None:
+                    metrics.end_iteration()
+                elapsed = time.perf_counter() - start
+                if i < iters and not schedule.due(i, elapsed):
+                    continue
+                if metrics_log is None:
+                    utilities.append(player_expected_utility)
+                    iterations.append(i)
+                else:
+                    metrics_log.write({'iteration': i, 'utility': player_expected_utility,
+                                       'elapsed': elapsed, 'iters_per_sec': (i - first) / elapsed})
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, game, tables, engine)
+
+        # Compute the average strategy
+        avg_strategy = {}
+        with phase(metrics, 'averaging'):
+            for info_set_name in strategy_sum:
+                avg_strategy[info_set_name] = normalize(strategy_sum[info_set_name])
+    finally:
+        if metrics is not None:
+            metrics.finish()
 
+    if return_iterations:
+        return avg_strategy, regrets, utilities, iterations
     return avg_strategy, regrets, utilities
 
 def learning_to_best_respond(tree, info_sets, game_name):
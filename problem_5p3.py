@@ -1,7 +1,21 @@
+import time
 from utils import get_player_from_info_set, graph_output
-from problem_5p2 import regret_matching, normalize
+from problem_5p2 import regret_matching, regret_matching_row, normalize, init_tables
+from flat_game import compile_game, TERMINAL, DECISION
+from vectorized_cfr import VectorizedCFR, regret_matching_table, normalize_table
+from best_response import BestResponse
+from convergence import make_schedule, open_log
+from cfr_variants import Variant, make_variant, floor_table, discount_table, floor_rows, discount_rows
+from mccfr import SamplingEngine, SAMPLERS
+from parallel_cfr import ParallelEngine
+from checkpoint import save_checkpoint, load_checkpoint, restore_checkpoint, warm_start_tables
+from instrumentation import phase, NODE_TYPES
 
-def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
+ENGINES = ['recursive', 'flat', 'vectorized'] + SAMPLERS
+
+def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None, metrics=None):
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
     # Base case
     if tree.type == 'TerminalNode':
         # Return payoff of player
@@ -13,7 +27,7 @@ def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
         if info_set_name in info_set_memo:
             # Already considered all decision nodes in this info set
             best_action = info_set_memo[info_set_name]
-            return expectimax(tree.children[best_action], info_sets, player, info_set_memo, opponent_strategy)
+            return expectimax(tree.children[best_action], info_sets, player, info_set_memo, opponent_strategy, metrics)
         info_set = info_sets.get_info_set(info_set_name)
 
         # Get best action utility over all nodes in the info set
@@ -24,7 +38,7 @@ def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
             action_expected_payoff = 0
             for decision_node in info_set:
                 child_node = decision_node.children[action]
-                expected_payoff = expectimax(child_node, info_sets, player, info_set_memo, opponent_strategy)
+                expected_payoff = expectimax(child_node, info_sets, player, info_set_memo, opponent_strategy, metrics)
                 action_expected_payoff += expected_payoff / len(info_set)
             if action_expected_payoff > best_expected_payoff:
                 best_action = action
@@ -34,7 +48,7 @@ def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
         info_set_memo[info_set_name] = best_action
         
         # Get expected payoff for this action
-        return expectimax(tree.children[best_action], info_sets, player, info_set_memo, opponent_strategy)
+        return expectimax(tree.children[best_action], info_sets, player, info_set_memo, opponent_strategy, metrics)
     elif (tree.type == 'DecisionNode' and tree.node.player != player) or tree.type == 'ChanceNode':
         # Treat opponent like a chance node -> return expected payoff
         total_expected_payoff = 0
@@ -42,7 +56,7 @@ def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
         num_actions = len(tree.children)
         uniform_strategy = 1/num_actions
         for edge, child_node in tree.children.items():
-            expected_payoff = expectimax(child_node, info_sets, player, info_set_memo, opponent_strategy)
+            expected_payoff = expectimax(child_node, info_sets, player, info_set_memo, opponent_strategy, metrics)
             # Calculate probability to weight this payoff
             if tree.type == 'ChanceNode':
                 prob = tree.node.probs[edge]
@@ -58,13 +72,24 @@ def expectimax(tree, info_sets, player, info_set_memo, opponent_strategy=None):
         # Shouldn't happen
         raise Exception
 
-def compute_nash_gap(tree, info_sets, avg_strategy):
-    br_p1 = expectimax(tree, info_sets, player='1', info_set_memo={}, opponent_strategy=avg_strategy)
-    br_p2 = expectimax(tree, info_sets, player='2', info_set_memo={}, opponent_strategy=avg_strategy)
-    nash_gap = br_p1 + br_p2
-    return nash_gap
+def compute_nash_gap(tree, info_sets, avg_strategy, best_response=None):
+    # Best responses are computed in two linear passes over the compiled game, weighting each
+    # node of an info set by its opponent and chance reach. Pass a BestResponse to reuse it
+    # across calls, info sets missing from avg_strategy are played uniformly
+    if best_response is None:
+        best_response = BestResponse(compile_game(tree, info_sets))
+    game = best_response.game
+    strategy = game.dict_to_table(avg_strategy, default=game.uniform_strategy())
+    return best_response.nash_gap(strategy)
 
-def cfr_utility_dual(tree, info_sets, regrets, strategy_sum, rprob1=1.0, rprob2=1.0):
+def cfr_utility_dual(tree, info_sets, regrets, strategy_sum, rprob1=1.0, rprob2=1.0,
+                     update_player=None, metrics=None):
+    # update_player restricts the regret and strategy sum updates to one player, None updates both
+    # Children that neither player reaches are skipped: their regret updates are weighted by a
+    # zero reach, their strategy sum updates by the other zero reach, and their values by a
+    # zero probability in every ancestor whose value is still used
+    if metrics is not None:
+        metrics.visit(tree.type, tree.info_set)
     if tree.type == 'TerminalNode':
         return tree.node.payoffs  # return payoff dict for all players
     elif tree.type == 'DecisionNode':
@@ -73,8 +98,10 @@ def cfr_utility_dual(tree, info_sets, regrets, strategy_sum, rprob1=1.0, rprob2=
 
         # Compute strategy for this player
         strategy = regret_matching(regrets[info_set])
-        for a in tree.children:
-            strategy_sum[info_set][a] += (rprob1 if player == '1' else rprob2) * strategy[a]
+        update = update_player is None or update_player == player
+        if update:
+            for a in tree.children:
+                strategy_sum[info_set][a] += (rprob1 if player == '1' else rprob2) * strategy[a]
 
         # Compute expected utility for each action
         action_utils = {}
@@ -82,62 +109,349 @@ def cfr_utility_dual(tree, info_sets, regrets, strategy_sum, rprob1=1.0, rprob2=
         for a, child_node in tree.children.items():
             next_rprob1 = rprob1 * strategy[a] if player == '1' else rprob1
             next_rprob2 = rprob2 * strategy[a] if player == '2' else rprob2
+            if next_rprob1 == 0.0 and next_rprob2 == 0.0:
+                continue
             child_util = cfr_utility_dual(child_node, info_sets, regrets, strategy_sum,
-                                          next_rprob1, next_rprob2)
+                                          next_rprob1, next_rprob2, update_player, metrics)
             action_utils[a] = child_util
             node_value['1'] += strategy[a] * child_util['1']
             node_value['2'] += strategy[a] * child_util['2']
 
         # Update regrets for this player
-        for a in tree.children:
-            regret = action_utils[a][player] - node_value[player]
-            if player == '1':
-                regrets[info_set][a] += rprob2 * regret
-            else:
-                regrets[info_set][a] += rprob1 * regret
+        if update:
+            opp_rprob = rprob2 if player == '1' else rprob1
+            regret_row = regrets[info_set]
+            for a, child_util in action_utils.items():
+                regret_row[a] += opp_rprob * (child_util[player] - node_value[player])
 
         return node_value
     elif tree.type == 'ChanceNode':
         total_expected = {'1': 0.0, '2': 0.0}
         for a, child_node in tree.children.items():
             prob = tree.node.probs[a]
+            if prob == 0.0:
+                continue
             child_util = cfr_utility_dual(child_node, info_sets, regrets, strategy_sum,
-                                          rprob1 * prob, rprob2 * prob)
+                                          rprob1 * prob, rprob2 * prob, update_player, metrics)
             total_expected['1'] += prob * child_util['1']
             total_expected['2'] += prob * child_util['2']
         return total_expected
     else:
         raise Exception("Unknown node type")
 
-def cfr_dual(tree, info_sets, iters=1000):
-    # Initialize regrets and strategy sums for both players
-    regrets = {}
-    strategy_sum = {}
-    for info_set_name in info_sets.get_info_sets():
-        nodes = info_sets.get_info_set(info_set_name)
-        actions = set()
-        for node in nodes:
-            if node.type == 'DecisionNode':
-                actions.update(node.node.actions)
-        regrets[info_set_name] = {a: 0 for a in actions}
-        strategy_sum[info_set_name] = {a: 0 for a in actions}
+def cfr_utility_flat(game, node, regrets, strategy_sum, rprob1=1.0, rprob2=1.0,
+                     update_player=None, metrics=None):
+    # Same traversal as cfr_utility_dual on a compiled FlatGame, regrets and strategy sums
+    # are lists of per info set rows in the info set's action order and update_player is a
+    # player index. The node lists are unpacked once and the recursion runs in a closure over them
+    kind, player, info_set, child_start, child_count, prob, payoffs = game.node_lists()
+    info_set_names = game.info_set_names
+
+    def traverse(node, rprob1, rprob2):
+        if metrics is not None:
+            i = info_set[node]
+            metrics.visit(NODE_TYPES[kind[node]], info_set_names[i] if i >= 0 else None)
+        if kind[node] == TERMINAL:
+            return payoffs[node] # list of payoffs indexed by player
+        elif kind[node] == DECISION:
+            p = player[node]
+            i = info_set[node]
+
+            # Compute strategy for this player
+            strategy = regret_matching_row(regrets[i])
+            update = update_player is None or update_player == p
+            if update:
+                own_rprob = rprob1 if p == 0 else rprob2
+                strategy_sum_row = strategy_sum[i]
+                for a, prob_a in enumerate(strategy):
+                    strategy_sum_row[a] += own_rprob * prob_a
+
+            # Compute expected utility for each action, None for skipped children
+            action_utils = []
+            node_value = [0.0, 0.0]
+            start = child_start[node]
+            for a, prob_a in enumerate(strategy):
+                next_rprob1 = rprob1 * prob_a if p == 0 else rprob1
+                next_rprob2 = rprob2 * prob_a if p == 1 else rprob2
+                if next_rprob1 == 0.0 and next_rprob2 == 0.0:
+                    action_utils.append(None)
+                    continue
+                child_util = traverse(start + a, next_rprob1, next_rprob2)
+                action_utils.append(child_util)
+                node_value[0] += prob_a * child_util[0]
+                node_value[1] += prob_a * child_util[1]
+
+            # Update regrets for this player
+            if update:
+                opp_rprob = rprob2 if p == 0 else rprob1
+                regret_row = regrets[i]
+                for a, child_util in enumerate(action_utils):
+                    if child_util is not None:
+                        regret_row[a] += opp_rprob * (child_util[p] - node_value[p])
+
+            return node_value
+        else:
+            total_expected = [0.0, 0.0]
+            start = child_start[node]
+            for child in range(start, start + child_count[node]):
+                child_prob = prob[child]
+                if child_prob == 0.0:
+                    continue
+                child_util = traverse(child, rprob1 * child_prob, rprob2 * child_prob)
+                total_expected[0] += child_prob * child_util[0]
+                total_expected[1] += child_prob * child_util[1]
+            return total_expected
+
+    return traverse(node, rprob1, rprob2)
+
+def rows_to_dict(game, rows):
+    return {name: dict(zip(game.info_set_actions[i], rows[i]))
+            for i, name in enumerate(game.info_set_names)}
+
+def rows_to_table(game, rows):
+    table = game.zeros()
+    for i, row in enumerate(rows):
+        table[i, :len(row)] = row
+    return table
+
+### CFR engines ###
+
+# Every engine owns its regret and strategy sum tables, applies the update rules of its
+# cfr_variants.Variant and exposes the same methods:
+# iterate() runs one CFR iteration and returns the (player 1, player 2) root utilities,
+# average_strategy() and regret_dict() return the nested dicts returned by cfr_dual and
+# average_table(game) returns the average strategy as a dense table of the compiled game.
+# get_tables(game) and set_tables(game, regrets, strategy_sum) read and write the regret and
+# strategy sum tables in that dense layout, and iteration counts the iterations run so far
+
+class RecursiveEngine:
+    def __init__(self, tree, info_sets, variant):
+        self.tree = tree
+        self.info_sets = info_sets
+        self.variant = variant
+        self.iteration = 0
+        self.metrics = None
+        self.regrets, self.strategy_sum = init_tables(info_sets)
+
+    def iterate(self):
+        self.iteration += 1
+        for update_player in (['1', '2'] if self.variant.alternating else [None]):
+            with phase(self.metrics, 'traversal'):
+                util = cfr_utility_dual(self.tree, self.info_sets, self.regrets, self.strategy_sum,
+                                        update_player=update_player, metrics=self.metrics)
+            with phase(self.metrics, 'floor_discount'):
+                if self.variant.floor_regrets:
+                    floor_rows(self.regrets.values())
+        with phase(self.metrics, 'floor_discount'):
+            discount_rows(self.variant, self.regrets.values(), self.strategy_sum.values(), self.iteration)
+        return util['1'], util['2']
+
+    def average_strategy(self):
+        return {info_set_name: normalize(self.strategy_sum[info_set_name])
+                for info_set_name in self.strategy_sum}
+
+    def average_table(self, game):
+        return game.dict_to_table(self.average_strategy())
+
+    def regret_dict(self):
+        return self.regrets
+
+    def get_tables(self, game):
+        return game.dict_to_table(self.regrets), game.dict_to_table(self.strategy_sum)
+
+    def set_tables(self, game, regrets, strategy_sum):
+        game.fill_dict(self.regrets, regrets)
+        game.fill_dict(self.strategy_sum, strategy_sum)
+
+class FlatEngine:
+    def __init__(self, game, variant):
+        self.game = game
+        self.variant = variant
+        self.iteration = 0
+        self.metrics = None
+        self.regrets = [[0.0] * n for n in game.num_actions.tolist()]
+        self.strategy_sum = [[0.0] * n for n in game.num_actions.tolist()]
+
+    def iterate(self):
+        self.iteration += 1
+        for update_player in ([0, 1] if self.variant.alternating else [None]):
+            with phase(self.metrics, 'traversal'):
+                util = cfr_utility_flat(self.game, 0, self.regrets, self.strategy_sum,
+                                        update_player=update_player, metrics=self.metrics)
+            with phase(self.metrics, 'floor_discount'):
+                if self.variant.floor_regrets:
+                    floor_rows(self.regrets)
+        with phase(self.metrics, 'floor_discount'):
+            discount_rows(self.variant, self.regrets, self.strategy_sum, self.iteration)
+        return util[0], util[1]
+
+    def average_strategy(self):
+        return {name: normalize(counts)
+                for name, counts in rows_to_dict(self.game, self.strategy_sum).items()}
+
+    def average_table(self, game):
+        return normalize_table(self.game, rows_to_table(self.game, self.strategy_sum))
+
+    def regret_dict(self):
+        return rows_to_dict(self.game, self.regrets)
+
+    def get_tables(self, game):
+        return rows_to_table(self.game, self.regrets), rows_to_table(self.game, self.strategy_sum)
+
+    def set_tables(self, game, regrets, strategy_sum):
+        for i, n in enumerate(self.game.num_actions.tolist()):
+            self.regrets[i] = regrets[i, :n].tolist()
+            self.strategy_sum[i] = strategy_sum[i, :n].tolist()
+
+class VectorizedEngine:
+    def __init__(self, game, variant):
+        self.game = game
+        self.variant = variant
+        self.iteration = 0
+        self.metrics = None
+        self.passes = VectorizedCFR(game)
+        self.regrets = game.zeros()
+        self.strategy_sum = game.zeros()
+
+    def iterate(self):
+        self.iteration += 1
+        for update_player in ([0, 1] if self.variant.alternating else [None]):
+            with phase(self.metrics, 'traversal'):
+                strategy = regret_matching_table(self.game, self.regrets)
+                util, regret_delta, strategy_delta = self.passes.cfr_pass(strategy, update_player)
+            with phase(self.metrics, 'regret_update'):
+                self.regrets += regret_delta
+                self.strategy_sum += strategy_delta
+                if self.variant.floor_regrets:
+                    floor_table(self.regrets)
+            if self.metrics is not None:
+                self.metrics.visit_game(self.game)
+        with phase(self.metrics, 'regret_update'):
+            discount_table(self.variant, self.regrets, self.strategy_sum, self.iteration)
+        return float(util[0]), float(util[1])
+
+    def average_strategy(self):
+        return self.game.table_to_dict(self.average_table(self.game))
+
+    def average_table(self, game):
+        return normalize_table(self.game, self.strategy_sum)
+
+    def regret_dict(self):
+        return self.game.table_to_dict(self.regrets)
+
+    def get_tables(self, game):
+        return self.regrets.copy(), self.strategy_sum.copy()
+
+    def set_tables(self, game, regrets, strategy_sum):
+        self.regrets[:] = regrets
+        self.strategy_sum[:] = strategy_sum
+
+def make_engine(tree, info_sets, engine, game=None, variant='vanilla', seed=None, workers=None):
+    # engine: 'recursive' walks the TreeNode objects, 'flat' walks a compiled FlatGame,
+    # 'vectorized' runs each iteration as batched NumPy passes over a compiled FlatGame and
+    # 'chance', 'external', 'outcome' are the Monte Carlo samplers of mccfr seeded with seed.
+    # workers > 1 splits the vectorized engine's passes over that many processes
+    if engine not in ENGINES:
+        raise ValueError(f'Unknown CFR engine {engine}, expected one of {ENGINES}')
+    if workers is not None and workers > 1 and engine != 'vectorized':
+        raise ValueError('Parallel CFR is only available with the vectorized engine')
+    variant = make_variant(variant)
+    if engine == 'recursive':
+        return RecursiveEngine(tree, info_sets, variant)
+    if engine in SAMPLERS:
+        return SamplingEngine(tree, info_sets, variant, engine, seed)
+    if game is None:
+        game = compile_game(tree, info_sets)
+    if engine == 'flat':
+        return FlatEngine(game, variant)
+    if workers is not None and workers > 1:
+        return ParallelEngine(tree, info_sets, game, variant, workers)
+    return VectorizedEngine(game, variant)
+
+def cfr_dual(tree, info_sets, iters=1000, engine='recursive', schedule=None, log=None,
+             variant=None, seed=None, workers=None, checkpoint=None, checkpoint_every=None,
+             resume=None, warm_start=None, warm_start_iters=100, metrics=None,
+             return_iterations=False):
+    # variant selects the update rule, a name from cfr_variants.VARIANTS ('vanilla', 'cfr+',
+    # 'linear', 'dcfr') or a Variant, e.g. make_variant('dcfr', alpha=1.5, beta=0, gamma=2),
+    # and defaults to vanilla or, when resuming, to the checkpoint's variant.
+    # schedule picks the iterations at which the nash gap is evaluated (every iteration by
+    # default, see convergence.make_schedule). The metrics of each evaluation are streamed to
+    # log (a .jsonl/.csv path or ConvergenceLog) if given, and otherwise collected in the
+    # returned utilities and nash_gaps lists, return_iterations appends the list of the
+    # iterations they were recorded at to the returned tuple. workers > 1 runs the vectorized
+    # engine in that many processes, split by the outcomes of the root chance node.
+    # The solver state is saved to the checkpoint path every checkpoint_every iterations and at
+    # the end. resume continues from a checkpoint file up to a total of iters iterations,
+    # appending to a log path that already holds the interrupted run's rows, and
+    # warm_start seeds a new solve with a previous avg_strategy as if it had been played for
+    # warm_start_iters iterations. metrics (an instrumentation.Metrics) records phase timings,
+    # node visits and info set touches, see instrumentation
+    game = compile_game(tree, info_sets)
+    state = None
+    if resume is not None:
+        state = load_checkpoint(resume)
+        if state.engine.startswith('cfr:'):
+            raise ValueError(f'Checkpoint was saved by problem_5p2.cfr ({state.engine}), which '
+                             'only learns one player')
+        if variant is None:
+            variant = Variant(**state.variant)
+    best_response = BestResponse(game)
+    schedule = make_schedule(schedule)
 
     utilities = []
     nash_gaps = []
-    for _ in range(iters):
-        # Run cfr and compute utilities
-        util = cfr_utility_dual(tree, info_sets, regrets, strategy_sum)
-        utilities.append((util['1'], util['2']))
-
-        # Compute average strategies for both players
-        avg_strategy = {info_set_name: normalize(strategy_sum[info_set_name])
-                        for info_set_name in strategy_sum}
-        
-        # Compute nash gap
-        nash_gap = compute_nash_gap(tree, info_sets, avg_strategy)
-        nash_gaps.append(nash_gap)
+    iterations = []
+    # Engines may hold worker processes and shared memory from here on, so everything after
+    # make_engine runs inside the try that closes them
+    solver = make_engine(tree, info_sets, engine, game, variant, seed, workers)
+    try:
+        solver.metrics = metrics
+        if state is not None:
+            restore_checkpoint(state, game, solver)
+        elif warm_start is not None:
+            solver.set_tables(game, *warm_start_tables(game, warm_start, warm_start_iters))
+        with open_log(log, append=resume is not None) as metrics_log:
+            first = solver.iteration
+            start = time.perf_counter()
+            for i in range(solver.iteration + 1, iters + 1):
+                # Run cfr and compute utilities
+                if metrics is not None:
+                    metrics.begin_iteration(i)
+                util = solver.iterate()
+                if checkpoint is not None and checkpoint_every and i % checkpoint_every == 0:
+                    save_checkpoint(checkpoint, game, solver, engine)
 
-    return avg_strategy, regrets, utilities, nash_gaps
+                if i == iters or schedule.due(i, time.perf_counter() - start):
+                    # Compute nash gap of the average strategies for both players
+                    with phase(metrics, 'averaging'):
+                        average = solver.average_table(game)
+                    with phase(metrics, 'gap'):
+                        nash_gap = best_response.nash_gap(average)
+                    if metrics_log is None:
+                        utilities.append(util)
+                        nash_gaps.append(nash_gap)
+                        iterations.append(i)
+                    else:
+                        elapsed = time.perf_counter() - start
+                        metrics_log.write({'iteration': i, 'nash_gap': nash_gap, 'utility_1': util[0],
+                                           'utility_2': util[1], 'elapsed': elapsed,
+                                           'iters_per_sec': (i - first) / elapsed})
+                if metrics is not None:
+                    metrics.end_iteration()
+        if checkpoint is not None:
+            save_checkpoint(checkpoint, game, solver, engine)
+        avg_strategy = solver.average_strategy()
+    finally:
+        if metrics is not None:
+            metrics.finish()
+        # Engines holding processes or other resources release them in close()
+        close = getattr(solver, 'close', None)
+        if close is not None:
+            close()
+    if return_iterations:
+        return avg_strategy, solver.regret_dict(), utilities, nash_gaps, iterations
+    return avg_strategy, solver.regret_dict(), utilities, nash_gaps
 
 def learning_the_nash_equilibrium(tree, info_sets, game_name):
     # Run CFR with the players playing against each other
@@ -0,0 +1,171 @@
+import numpy as np
+from flat_game import compile_game, TERMINAL, DECISION
+
+### Sequence form of a two player zero sum game ###
+
+# A sequence of a player is the empty sequence (id 0) or one of their (info set, action) pairs,
+# realization plans x, y over sequences satisfy E x = e, F y = f, x, y >= 0 with one row for the
+# empty sequence and one per info set (its actions sum to its parent sequence), and player 1's
+# expected utility is x^T A y with A summing chance weighted payoffs over terminal nodes
+
+class SequenceForm:
+    def __init__(self, game):
+        self.game = game
+        terminals = np.flatnonzero(game.kind == TERMINAL)
+        payoff_sums = game.payoffs[terminals].sum(axis=1)
+        if len(terminals) and not np.allclose(payoff_sums, payoff_sums[0]):
+            raise ValueError('The sequence form solver needs a zero sum (or constant sum) game')
+        self.payoff_sum = float(payoff_sums[0]) if len(terminals) else 0.0
+
+        # Per player sequence ids of the (info set, action) table entries, -1 elsewhere
+        self.seq_table = []
+        self.num_sequences = []
+        for p in range(2):
+            owned = game.action_mask & (game.info_set_player == p)[:, None]
+            table = np.full(game.action_mask.shape, -1, dtype=np.int64)
+            table[owned] = np.arange(1, int(owned.sum()) + 1)
+            self.seq_table.append(table)
+            self.num_sequences.append(int(owned.sum()) + 1)
+
+        # Top down pass for each node's last sequence of both players and its chance reach
+        n = game.num_nodes
+        node_seq = np.zeros((2, n), dtype=np.int64)
+        chance_reach = np.ones(n)
+        levels = list(game.levels())
+        for start, end in levels[1:]:
+            parent = game.parent[start:end]
+            chance_reach[start:end] = chance_reach[parent] * game.prob[start:end]
+            for p in range(2):
+                node_seq[p, start:end] = node_seq[p, parent]
+                own = (game.kind[parent] == DECISION) & (game.player[parent] == p)
+                node_seq[p, start:end][own] = self.seq_table[p][game.info_set[parent[own]],
+                                                                game.edge_action[start:end][own]]
+
+        # Parent sequence of every info set, perfect recall makes it the same at all its nodes
+        decision_nodes = np.flatnonzero(game.kind == DECISION)
+        owner_seq = node_seq[game.player[decision_nodes], decision_nodes]
+        self.parent_seq = np.full(game.num_info_sets, -1, dtype=np.int64)
+        self.parent_seq[game.info_set[decision_nodes]] = owner_seq
+        if np.any(self.parent_seq[game.info_set[decision_nodes]] != owner_seq):
+            raise ValueError('The sequence form needs a game with perfect recall')
+
+        self.terminals = terminals
+        self.terminal_seq = node_seq[:, terminals]
+        self.terminal_payoff = chance_reach[terminals] * game.payoffs[terminals, 0]
+
+    def payoff_matrix(self):
+        # Sparse (player 1 sequences, player 2 sequences) matrix of player 1's payoffs
+        from scipy.sparse import coo_matrix
+        return coo_matrix((self.terminal_payoff, (self.terminal_seq[0], self.terminal_seq[1])),
+                          shape=tuple(self.num_sequences)).tocsr()
+
+    def constraints(self, player):
+        # Sparse E and dense e of the player's realization plan constraints E x = e
+        from scipy.sparse import coo_matrix
+        game = self.game
+        info_sets = np.flatnonzero(game.info_set_player == player)
+        rows = [0]
+        cols = [0]
+        values = [1.0]
+        for r, h in enumerate(info_sets, start=1):
+            rows.append(r)
+            cols.append(int(self.parent_seq[h]))
+            values.append(-1.0)
+            for seq in self.seq_table[player][h, :game.num_actions[h]]:
+                rows.append(r)
+                cols.append(int(seq))
+                values.append(1.0)
+        matrix = coo_matrix((values, (rows, cols)), shape=(len(info_sets) + 1, self.num_sequences[player]))
+        rhs = np.zeros(len(info_sets) + 1)
+        rhs[0] = 1.0
+        return matrix.tocsr(), rhs
+
+    def is_matrix_game(self):
+        # A single simultaneous decision per player, each player has one info set reached by the
+        # empty sequence and every terminal follows one action of each
+        game = self.game
+        return (game.num_info_sets == 2 and sorted(game.info_set_player.tolist()) == [0, 1]
+                and np.all(self.parent_seq == 0) and np.all(self.terminal_seq > 0))
+
+    def solve_player(self, player, payoffs):
+        # Optimal realization plan of player against a best responding opponent from the LP
+        #   max f^T q  s.t.  E x = e, x >= 0, F^T q <= A^T x (q free)
+        # for player 1, with A negated and transposed for player 2. Returns the plan and its value
+        from scipy.optimize import linprog
+        from scipy.sparse import hstack, csr_matrix
+        E, e = self.constraints(player)
+        F, f = self.constraints(1 - player)
+        A = payoffs if player == 0 else -payoffs.T
+        num_x = self.num_sequences[player]
+        num_q = F.shape[0]
+        cost = np.concatenate([np.zeros(num_x), -f])
+        A_ub = hstack([-A.T, F.T]).tocsr()
+        A_eq = hstack([E, csr_matrix((E.shape[0], num_q))]).tocsr()
+        bounds = [(0, None)] * num_x + [(None, None)] * num_q
+        result = linprog(cost, A_ub=A_ub, b_ub=np.zeros(A_ub.shape[0]), A_eq=A_eq, b_eq=e,
+                         bounds=bounds, method='highs')
+        if result.status != 0:
+            raise RuntimeError(f'Sequence form LP failed: {result.message}')
+        return result.x[:num_x], float(-result.fun)
+
+    def strategy_table(self, plans):
+        # Behavioral strategies of realization plans, unreached info sets play uniformly
+        game = self.game
+        table = game.uniform_strategy()
+        for p in range(2):
+            plan = plans[p]
+            for h in np.flatnonzero(game.info_set_player == p):
+                reach = plan[self.parent_seq[h]]
+                if reach <= 1e-12:
+                    continue
+                k = game.num_actions[h]
+                probs = np.maximum(plan[self.seq_table[p][h, :k]], 0) / reach
+                table[h, :k] = probs / probs.sum()
+        return table
+
+### Normal form fast path ###
+
+def solve_matrix_game(matrix):
+    # Maxmin mixed strategies of the row and column players of a dense payoff matrix (row
+    # player's payoffs) from max v s.t. M^T x >= v, sum x = 1, x >= 0 and its mirror
+    from scipy.optimize import linprog
+    rows, cols = matrix.shape
+    cost = np.zeros(rows + 1)
+    cost[-1] = -1.0
+    result = linprog(cost, A_ub=np.hstack([-matrix.T, np.ones((cols, 1))]), b_ub=np.zeros(cols),
+                     A_eq=np.append(np.ones(rows), 0.0)[None, :], b_eq=[1.0],
+                     bounds=[(0, None)] * rows + [(None, None)], method='highs')
+    if result.status != 0:
+        raise RuntimeError(f'Matrix game LP failed: {result.message}')
+    x, value = result.x[:rows], result.x[-1]
+
+    cost = np.zeros(cols + 1)
+    cost[-1] = 1.0
+    result = linprog(cost, A_ub=np.hstack([matrix, -np.ones((rows, 1))]), b_ub=np.zeros(rows),
+                     A_eq=np.append(np.ones(cols), 0.0)[None, :], b_eq=[1.0],
+                     bounds=[(0, None)] * cols + [(None, None)], method='highs')
+    if result.status != 0:
+        raise RuntimeError(f'Matrix game LP failed: {result.message}')
+    return x, result.x[:cols], float(value)
+
+### Exact equilibrium ###
+
+def solve_exact(tree, info_sets, game=None):
+    # Exact Nash equilibrium of a two player zero sum game, returns the avg_strategy dict shape
+    # of cfr_dual and the equilibrium utilities {'1': v1, '2': v2}
+    if game is None:
+        game = compile_game(tree, info_sets)
+    sequence_form = SequenceForm(game)
+    payoffs = sequence_form.payoff_matrix()
+
+    if sequence_form.is_matrix_game():
+        # Drop the empty sequences, the remaining rows and columns are the actions
+        x, y, value = solve_matrix_game(payoffs.toarray()[1:, 1:])
+        plans = [np.concatenate([[1.0], x]), np.concatenate([[1.0], y])]
+    else:
+        x, value = sequence_form.solve_player(0, payoffs)
+        y, _ = sequence_form.solve_player(1, payoffs)
+        plans = [x, y]
+
+    avg_strategy = game.table_to_dict(sequence_form.strategy_table(plans))
+    return avg_strategy, {'1': value, '2': sequence_form.payoff_sum - value}
@@ -0,0 +1,168 @@
+import argparse
+import time
+from statistics import NormalDist
+import numpy as np
+from flat_game import TERMINAL, DECISION, PLAYERS
+from game_cache import load_flat_game
+from checkpoint import load_checkpoint
+from policy import PolicyTable, checkpoint_strategy
+
+### Monte Carlo matches between strategy profiles ###
+
+# Hands are played in batches, every step moves all unfinished hands of a batch one edge down
+# the compiled game at once. The edges of every node get cumulative probabilities shifted by
+# the node's index, and breadth first order keeps the children of consecutive nodes
+# consecutive, so the shifted values increase over all edges and a single searchsorted samples
+# the next node of every hand
+
+def strategy_table(game, strategy):
+    # Dense table of a {info set: {action: prob}} strategy, 'uniform' or None for the uniform
+    # strategy, info sets missing from the strategy are played uniformly
+    if strategy is None or strategy == 'uniform':
+        return game.uniform_strategy()
+    return game.dict_to_table(strategy, default=game.uniform_strategy())
+
+def load_strategy(game, path):
+    # Strategy from a solver checkpoint (.npz) or a policy table (see policy), or 'uniform'
+    if path == 'uniform':
+        return game.uniform_strategy()
+    if path.endswith('.npz'):
+        return strategy_table(game, checkpoint_strategy(load_checkpoint(path)))
+    strategies = PolicyTable(path).strategies(game.info_set_names)
+    return strategy_table(game, {name: s for name, s in zip(game.info_set_names, strategies)
+                                 if s is not None})
+
+def edge_cdf(game, table1, table2):
+    # Shifted cumulative probability of the edge into every node but the root, player 1 plays
+    # the rows of table1 and player 2 the rows of table2
+    children = np.arange(1, game.num_nodes)
+    parent = game.parent[1:]
+    edge_prob = game.prob[1:].copy()
+    decision = game.kind[parent] == DECISION
+    rows = game.info_set[parent[decision]]
+    actions = game.edge_action[children[decision]]
+    edge_prob[decision] = np.where(game.player[parent[decision]] == 0,
+                                   table1[rows, actions], table2[rows, actions])
+
+    # Cumulative probabilities within every node's children, normalized to end at one
+    cumulative = np.cumsum(edge_prob)
+    first = game.child_start[parent] - 1
+    before = np.where(first > 0, cumulative[first - 1], 0.0)
+    last = first + game.child_count[parent] - 1
+    total = cumulative[last] - before
+    if np.any(total <= 0):
+        raise ValueError('A strategy gives every action of an info set probability zero')
+    within = (cumulative - before) / total
+    within[last] = 1.0
+    return parent + within
+
+class MatchResult:
+    # Mean payoff of every player with the half width of its confidence interval, from hands
+    # played in seconds
+    def __init__(self, hands, mean, half_width, confidence, seconds):
+        self.hands = hands
+        self.mean = mean
+        self.half_width = half_width
+        self.confidence = confidence
+        self.seconds = seconds
+
+    @property
+    def hands_per_second(self):
+        return self.hands / self.seconds if self.seconds > 0 else float('inf')
+
+    def report(self, names=PLAYERS):
+        lines = [f'{self.hands} hands in {self.seconds:.2f}s ({self.hands_per_second:,.0f} hands/sec)']
+        for name, mean, half_width in zip(names, self.mean, self.half_width):
+            lines.append(f'  {name}: {mean:+.5f} +- {half_width:.5f} ({self.confidence:.0%} confidence)')
+        return '\n'.join(lines)
+
+class PayoffStats:
+    # Running mean and sum of squared deviations of the payoffs of every player, batches are
+    # merged with Chan's parallel update so millions of hands don't lose precision
+    def __init__(self, players):
+        self.count = 0
+        self.mean = np.zeros(players)
+        self.m2 = np.zeros(players)
+
+    def add(self, payoffs):
+        n = len(payoffs)
+        mean = payoffs.mean(axis=0)
+        m2 = ((payoffs - mean) ** 2).sum(axis=0)
+        total = self.count + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / total
+        self.m2 = self.m2 + m2 + delta ** 2 * self.count * n / total
+        self.count = total
+
+    def variance_of_mean(self):
+        if self.count < 2:
+            return np.full_like(self.mean, np.inf)
+        return self.m2 / (self.count - 1) / self.count
+
+def play_hands(game, cdf, hands, rng):
+    # Terminal node of each of hands hands played from the root
+    kind = game.kind
+    child_start = game.child_start
+    child_end = game.child_start + game.child_count - 1
+    positions = np.zeros(hands, dtype=np.int64)
+    active = np.arange(hands) if kind[0] != TERMINAL else np.zeros(0, dtype=np.int64)
+    while len(active):
+        nodes = positions[active]
+        # cdf[k] belongs to the edge into node k + 1, clipping guards the rounding at the
+        # ends of each node's edges
+        children = np.searchsorted(cdf, nodes + rng.random(len(nodes)), side='right') + 1
+        children = np.clip(children, child_start[nodes], child_end[nodes])
+        positions[active] = children
+        active = active[kind[children] != TERMINAL]
+    return positions
+
+def simulate(game, table1, table2, hands, batch_size=1 << 16, seed=None, confidence=0.95):
+    # Play hands hands of player 1 using the rows of the dense strategy table table1 against
+    # player 2 using table2, returns a MatchResult with both players' mean payoffs
+    rng = np.random.default_rng(seed)
+    cdf = edge_cdf(game, table1, table2)
+    stats = PayoffStats(len(PLAYERS))
+    start = time.perf_counter()
+    for batch_start in range(0, hands, batch_size):
+        batch = min(batch_size, hands - batch_start)
+        stats.add(game.payoffs[play_hands(game, cdf, batch, rng)])
+    seconds = time.perf_counter() - start
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    return MatchResult(hands, stats.mean, z * np.sqrt(stats.variance_of_mean()), confidence, seconds)
+
+def match(game, table_a, table_b, hands, batch_size=1 << 16, seed=None, confidence=0.95):
+    # Head to head match between two strategy profiles, each sits as player 1 for half of the
+    # hands. Returns a MatchResult with the mean payoffs of a and b per hand, averaged over
+    # the seats so the advantage of either seat cancels out
+    rng = np.random.default_rng(seed)
+    first = simulate(game, table_a, table_b, hands // 2, batch_size, rng, confidence)
+    second = simulate(game, table_b, table_a, hands - hands // 2, batch_size, rng, confidence)
+    mean = (first.mean + second.mean[::-1]) / 2
+    # The seats are independent, so the variances of their means add
+    half_width = np.sqrt(first.half_width ** 2 + second.half_width[::-1] ** 2) / 2
+    return MatchResult(hands, mean, half_width, confidence, first.seconds + second.seconds)
+
+def main():
+    parser = argparse.ArgumentParser(description='Play Monte Carlo matches between two strategies')
+    parser.add_argument('game', help='game file')
+    parser.add_argument('a', help="strategy A: a checkpoint (.npz), a policy table or 'uniform'")
+    parser.add_argument('b', help='strategy B, same forms as A')
+    parser.add_argument('--hands', type=int, default=1_000_000)
+    parser.add_argument('--batch-size', type=int, default=1 << 16)
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--confidence', type=float, default=0.95)
+    parser.add_argument('--fixed-seats', action='store_true',
+                        help='A always plays player 1 and B player 2 instead of switching seats')
+    args = parser.parse_args()
+
+    game = load_flat_game(args.game)
+    table_a, table_b = load_strategy(game, args.a), load_strategy(game, args.b)
+    if args.fixed_seats:
+        result = simulate(game, table_a, table_b, args.hands, args.batch_size, args.seed, args.confidence)
+        print(result.report(['A as player 1', 'B as player 2']))
+    else:
+        result = match(game, table_a, table_b, args.hands, args.batch_size, args.seed, args.confidence)
+        print(result.report(['A', 'B']))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+from utils import DecisionNode, ChanceNode, TerminalNode, TreeNode, InformationSets
+from flat_game import PLAYERS
+from problem_5p3 import make_engine
+
+### Subgame re-solving ###
+
+# A subgame is grown from the node at a path until it is closed: every info set with a node in
+# the subtrees of its roots has all of its nodes there. Its roots all sit at the depth of the
+# starting node, so if an info set reaches above that depth the subgame can't be cut there.
+# Re-solving keeps the strategy outside the subgame and protects each player p in turn with
+# the re-solving gadget of CFR-D: a chance node picks a root in proportion to its chance and
+# p reach, then the opponent chooses between entering the root's subtree and terminating with
+# the counterfactual best response value it had against p's old strategy. The roots the
+# opponent can't tell apart share its gadget info set, so p's new strategy gives the opponent
+# no more than before at any of its info sets, and p's rows from the solved gadget game are
+# spliced into the strategy. Everything but the walks up to the game root is proportional to
+# the size of the subgame. Payoffs must be zero sum
+
+def node_depth(node):
+    depth = 0
+    while node.parent is not None:
+        node = node.parent
+        depth += 1
+    return depth
+
+def node_path(node):
+    # Path of actions from the game root to node, in the convert_history_to_path format
+    path = []
+    while node.parent is not None:
+        path.append(next(a for a, child in node.parent.children.items() if child is node))
+        node = node.parent
+    return tuple(reversed(path))
+
+def subtree_nodes(root):
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        yield node
+        stack.extend(node.children.values())
+
+def action_prob(strategy, info_set, action, actions):
+    # Probability of action in a strategy, info sets missing from it are played uniformly
+    row = strategy.get(info_set)
+    return row[action] if row is not None else 1.0 / len(actions)
+
+class Subgame:
+    # The closed subgame grown from the node at path: roots (TreeNodes), their paths and the
+    # names of the info sets inside it
+    def __init__(self, tree, info_sets, path):
+        start = tree.get_node(list(path))
+        self.depth = node_depth(start)
+        self.roots = []
+        self.info_set_names = []
+        root_ids = set()
+        seen = set()
+        queue = [start]
+        while queue:
+            root = queue.pop()
+            if id(root) in root_ids:
+                continue
+            root_ids.add(id(root))
+            self.roots.append(root)
+            for node in subtree_nodes(root):
+                if node.type != 'DecisionNode' or node.info_set in seen:
+                    continue
+                seen.add(node.info_set)
+                self.info_set_names.append(node.info_set)
+                for member in info_sets.get_info_set(node.info_set):
+                    queue.append(self.ancestor_at_depth(member, node.info_set))
+        self.paths = [node_path(root) for root in self.roots]
+
+    def ancestor_at_depth(self, node, info_set):
+        depth = node_depth(node)
+        if depth < self.depth:
+            raise ValueError(f'Info set {info_set} has a node above the subgame roots, '
+                             'the subgame is not closed at this depth')
+        for _ in range(depth - self.depth):
+            node = node.parent
+        return node
+
+    def reaches(self, strategy):
+        # {root path: (chance reach, {player: reach})} of the roots under strategy
+        result = {}
+        for root, path in zip(self.roots, self.paths):
+            chance = 1.0
+            reach = dict.fromkeys(PLAYERS, 1.0)
+            node = root
+            while node.parent is not None:
+                parent = node.parent
+                action = next(a for a, child in parent.children.items() if child is node)
+                if parent.type == 'ChanceNode':
+                    chance *= parent.node.probs[action]
+                else:
+                    reach[parent.node.player] *= action_prob(strategy, parent.info_set, action,
+                                                             parent.node.actions)
+                node = parent
+            result[path] = (chance, reach)
+        return result
+
+class ResolvingGadget:
+    # Counterfactual best response values of the opponent o of the protected player p at the
+    # roots of a subgame, and the gadget game built from them
+    def __init__(self, subgame, strategy, reaches, p):
+        self.p = p
+        self.o = PLAYERS[1 - PLAYERS.index(p)]
+        self.strategy = strategy
+        # Chance times p reach of every root, roots p never reaches are left out
+        self.roots = []
+        self.weights = []
+        for root, path in zip(subgame.roots, subgame.paths):
+            chance, reach = reaches[path]
+            if chance * reach[p] > 0:
+                self.roots.append(root)
+                self.weights.append(chance * reach[p])
+
+    def best_response(self):
+        # Weighted value for o of every root when o best responds to p's old strategy, weights
+        # are the chance and p reach of every node. o picks one action per info set, the one
+        # with the largest weighted value summed over the info set's nodes
+        weights = {}
+        o_members = {}
+        stack = list(zip(self.roots, self.weights))
+        while stack:
+            node, weight = stack.pop()
+            weights[id(node)] = weight
+            if node.type == 'DecisionNode' and node.node.player == self.o:
+                o_members.setdefault(node.info_set, []).append(node)
+            for a, child in node.children.items():
+                if node.type == 'ChanceNode':
+                    stack.append((child, weight * node.node.probs[a]))
+                elif node.node.player == self.p:
+                    stack.append((child, weight * action_prob(self.strategy, node.info_set, a,
+                                                              node.node.actions)))
+                else:
+                    stack.append((child, weight))
+        values = {}
+        choices = {}
+
+        def value(node):
+            v = values.get(id(node))
+            if v is not None:
+                return v
+            if node.type == 'TerminalNode':
+                payoffs = node.node.payoffs
+                if abs(payoffs[self.p] + payoffs[self.o]) > 1e-9:
+                    raise ValueError('Subgame re-solving needs zero sum payoffs')
+                v = weights[id(node)] * payoffs[self.o]
+            elif node.type == 'DecisionNode' and node.node.player == self.o:
+                if node.info_set not in choices:
+                    actions = node.node.actions
+                    totals = [sum(value(m.children[a]) for m in o_members[node.info_set]) for a in actions]
+                    choices[node.info_set] = actions[totals.index(max(totals))]
+                v = value(node.children[choices[node.info_set]])
+            else:
+                # Chance and p probabilities are in the weights
+                v = sum(value(child) for child in node.children.values())
+            values[id(node)] = v
+            return v
+
+        return [value(root) for root in self.roots]
+
+    def opponent_groups(self):
+        # Group index of every root, roots sharing one of o's info sets below share a group
+        group = list(range(len(self.roots)))
+
+        def find(k):
+            while group[k] != k:
+                group[k] = group[group[k]]
+                k = group[k]
+            return k
+
+        owner = {}
+        for k, root in enumerate(self.roots):
+            for node in subtree_nodes(root):
+                if node.type == 'DecisionNode' and node.node.player == self.o:
+                    other = owner.setdefault(node.info_set, k)
+                    group[find(k)] = find(other)
+        return [find(k) for k in range(len(self.roots))]
+
+    def build(self):
+        # Gadget game tree and info sets
+        values = self.best_response()
+        groups = self.opponent_groups()
+        group_value = {}
+        group_weight = {}
+        for value, weight, g in zip(values, self.weights, groups):
+            group_value[g] = group_value.get(g, 0.0) + value
+            group_weight[g] = group_weight.get(g, 0.0) + weight
+        total = sum(self.weights)
+
+        members = {}
+        root = TreeNode(ChanceNode({f'R{k}': w / total for k, w in enumerate(self.weights)}))
+        for k, (subgame_root, g) in enumerate(zip(self.roots, groups)):
+            gadget = TreeNode(DecisionNode(self.o, ['F', 'T']))
+            gadget.set_info_set(f'/G{self.o}:{g}/')
+            members.setdefault(gadget.info_set, []).append(gadget)
+            attach(root, f'R{k}', gadget)
+            # Terminating pays o its best response value per unit of the group's weight
+            value = group_value[g] / group_weight[g]
+            attach(gadget, 'T', TreeNode(TerminalNode({self.o: value, self.p: -value})))
+            attach(gadget, 'F', copy_subtree(subgame_root, members))
+        info_sets = InformationSets()
+        for name, nodes in members.items():
+            info_sets.add_info_set(name, nodes)
+        return root, info_sets
+
+def attach(parent, action, child):
+    child.set_parent(parent)
+    parent.set_child(action, child)
+
+def copy_subtree(root, members):
+    # Copy of the subtree of root sharing its Decision/Chance/TerminalNode objects, the copied
+    # decision nodes are added to members by info set
+    copy = TreeNode(root.node)
+    stack = [(root, copy)]
+    while stack:
+        node, new = stack.pop()
+        if node.type == 'DecisionNode':
+            new.set_info_set(node.info_set)
+            members.setdefault(node.info_set, []).append(new)
+        for a, child in node.children.items():
+            new_child = TreeNode(child.node)
+            attach(new, a, new_child)
+            stack.append((child, new_child))
+    return copy
+
+def resolve_subgame(tree, info_sets, path, strategy, reach=None, iters=1000, engine='vectorized',
+                    variant='cfr+', players=PLAYERS):
+    # Re-solve the closed subgame grown from the node at path (a list of actions, see
+    # utils.convert_history_to_path) of a possibly modified tree, keeping strategy (e.g.
+    # cfr_dual's avg_strategy) outside of it. reach optionally gives {root path: {player:
+    # reach}} for the subgame roots (Subgame(tree, info_sets, path).paths), by default the
+    # reaches come from strategy. Each player in players gets a strategy from its own gadget
+    # game solved for iters iterations with engine and variant (see make_engine). The gadget
+    # only protects p once its game is nearly solved, and vanilla CFR's average can still give
+    # more away after 1000 iterations, hence CFR+. Returns the spliced strategy, a new dict
+    subgame = Subgame(tree, info_sets, path)
+    reaches = subgame.reaches(strategy)
+    if reach is not None:
+        for root_path, root_reach in reach.items():
+            chance, player_reach = reaches[tuple(root_path)]
+            reaches[tuple(root_path)] = (chance, {**player_reach, **root_reach})
+
+    resolved = dict(strategy)
+    subgame_info_sets = set(subgame.info_set_names)
+    for p in players:
+        gadget = ResolvingGadget(subgame, strategy, reaches, p)
+        if not gadget.roots:
+            # p never reaches the subgame, any strategy there is as good as the old one
+            continue
+        gadget_tree, gadget_info_sets = gadget.build()
+        solver = make_engine(gadget_tree, gadget_info_sets, engine, variant=variant)
+        try:
+            for _ in range(iters):
+                solver.iterate()
+            average = solver.average_strategy()
+        finally:
+            close = getattr(solver, 'close', None)
+            if close is not None:
+                close()
+        for name, row in average.items():
+            if name in subgame_info_sets and gadget_info_sets.get_info_set(name)[0].node.player == p:
+                resolved[name] = row
+    return resolved
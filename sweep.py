@@ -0,0 +1,104 @@
+import argparse
+import itertools
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from utils import load_game_from_txt
+from convergence import ConvergenceLog
+from problem_5p3 import cfr_dual, ENGINES
+from cfr_variants import VARIANTS
+
+### Parallel experiment sweeps ###
+
+# Runs every combination of games x engines x variants x iteration budgets x seeds in a process
+# pool and appends one row per finished run to a .csv or .jsonl results file, so the sweep takes
+# about as long as its slowest runs rather than the sum of all of them
+
+# Games loaded by this worker process, keyed by path
+_games = {}
+
+def load_game(path):
+    if path not in _games:
+        _games[path] = load_game_from_txt(path)
+    return _games[path]
+
+def sweep_grid(games, engines=('vectorized',), variants=('vanilla',), iters=(1000,), seeds=(0,)):
+    # The runs of a sweep as (game, engine, variant, iters, seed) tuples
+    return list(itertools.product(games, engines, variants, iters, seeds))
+
+def check_grid(runs):
+    # Raise a ValueError for any run that can't start, before a worker is spawned
+    for game, engine, variant, iters, seed in runs:
+        if not os.path.isfile(game):
+            raise ValueError(f'Game file {game} does not exist')
+        if engine not in ENGINES:
+            raise ValueError(f'Unknown CFR engine {engine}, expected one of {ENGINES}')
+        if variant not in VARIANTS:
+            raise ValueError(f'Unknown CFR variant {variant}, expected one of {list(VARIANTS)}')
+        if not isinstance(iters, int) or iters < 1:
+            raise ValueError(f'Iteration budgets must be positive integers, got {iters!r}')
+
+def run_row(game, engine, variant, iters, seed, **results):
+    # Every row has the same columns so failed runs fit in the same .csv
+    row = {'game': os.path.splitext(os.path.basename(game))[0], 'engine': engine,
+           'variant': variant, 'iters': iters, 'seed': seed, 'nash_gap': None,
+           'utility_1': None, 'utility_2': None, 'wall_time': None, 'iters_per_sec': None,
+           'error': None}
+    row.update(results)
+    return row
+
+def run_one(game, engine, variant, iters, seed):
+    tree, info_sets = load_game(game)
+    start = time.perf_counter()
+    # Only the final iteration is evaluated
+    _, _, utilities, nash_gaps = cfr_dual(tree, info_sets, iters, engine=engine, variant=variant,
+                                          seed=seed, schedule=f'every:{iters}')
+    wall_time = time.perf_counter() - start
+    return run_row(game, engine, variant, iters, seed, nash_gap=nash_gaps[-1],
+                   utility_1=utilities[-1][0], utility_2=utilities[-1][1], wall_time=wall_time,
+                   iters_per_sec=iters / wall_time)
+
+def run_sweep(runs, output, processes=None, callback=None):
+    # Run the grid with up to processes workers (default: one per CPU), returns the result rows
+    # in the order the runs finished and calls callback(row) as each one finishes. A run that
+    # raises gets a row with its 'error' and the rest of the sweep goes on
+    check_grid(runs)
+    rows = []
+    with ConvergenceLog(output) as results, ProcessPoolExecutor(processes) as pool:
+        futures = {pool.submit(run_one, *run): run for run in runs}
+        for future in as_completed(futures):
+            try:
+                row = future.result()
+            except Exception as e:
+                row = run_row(*futures[future], error=f'{type(e).__name__}: {e}')
+            results.write(row)
+            rows.append(row)
+            if callback is not None:
+                callback(row)
+    return rows
+
+def format_row(row):
+    name = f"{row['game']} {row['engine']} {row['variant']} iters={row['iters']} seed={row['seed']}"
+    if row['error'] is None:
+        return f"{name}: gap {row['nash_gap']:.6g} in {row['wall_time']:.2f}s"
+    return f"{name}: failed, {row['error']}"
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a grid of CFR solves in parallel')
+    parser.add_argument('games', nargs='+', help='game files')
+    parser.add_argument('--engines', nargs='+', default=['vectorized'], choices=ENGINES)
+    parser.add_argument('--variants', nargs='+', default=['vanilla'], choices=list(VARIANTS))
+    parser.add_argument('--iters', nargs='+', type=int, default=[1000])
+    parser.add_argument('--seeds', nargs='+', type=int, default=[0])
+    parser.add_argument('--processes', type=int, default=None, help='worker processes (default: CPUs)')
+    parser.add_argument('--output', default='sweep_results.csv', help='.csv or .jsonl results file')
+    args = parser.parse_args()
+
+    runs = sweep_grid(args.games, args.engines, args.variants, args.iters, args.seeds)
+    try:
+        run_sweep(runs, args.output, args.processes, lambda row: print(format_row(row)))
+    except ValueError as e:
+        parser.error(str(e))
+
+if __name__ == '__main__':
+    main()
@@ -1,6 +1,3 @@
-import re
-import matplotlib.pyplot as plt
-
 ### Helpers ###
 
 def get_player_from_info_set(info_set_name, info_sets):
@@ -9,7 +6,21 @@ def get_player_from_info_set(info_set_name, info_sets):
         if node.type == 'DecisionNode':
             return node.node.player
 
-def graph_output(output, metric_name, game_name):    
+# Directory that graph_output writes figures to instead of showing them, see set_plot_dir
+plot_dir = None
+
+def set_plot_dir(directory):
+    # Write every following graph_output figure to directory in a background process instead
+    # of opening a window, None restores the interactive windows
+    global plot_dir
+    plot_dir = directory
+
+def graph_output(output, metric_name, game_name):
+    if plot_dir is not None:
+        from plotting import save_plot
+        save_plot(output, metric_name, game_name, plot_dir)
+        return
+    import matplotlib.pyplot as plt
     plt.figure()
     plt.plot(range(len(output)), output)
     plt.title(f'CFR Player 1 {metric_name} in {game_name}')
@@ -87,100 +98,146 @@ class InformationSets:
 
 ### Functions for loading a game from a txt file ###
 
+class GameFormatError(ValueError):
+    def __init__(self, message, filepath=None, line_number=None):
+        location = ''
+        if filepath is not None:
+            location = f'{filepath}:{line_number}: ' if line_number is not None else f'{filepath}: '
+        super().__init__(location + message)
+        self.filepath = filepath
+        self.line_number = line_number
+
 def convert_history_to_path(history):
     path = history.split('/')[1:-1]
     path = [act.split(':')[1] for act in path]
     return path
 
+def split_history(history):
+    # Split a history into its parent's history and the action on the last edge,
+    # e.g. '/C:JQ/P1:c/' -> ('/C:JQ/', 'c')
+    if len(history) < 2 or history[0] != '/' or history[-1] != '/':
+        raise GameFormatError(f'Bad history {history}')
+    head, _, last = history[:-1].rpartition('/')
+    _, sep, action = last.partition(':')
+    if not sep or not action:
+        raise GameFormatError(f'Bad history {history}')
+    return head + '/', action
+
+def parse_key_values(tokens, what):
+    # Parse 'key=value' tokens into a dict of floats
+    values = {}
+    for token in tokens:
+        key, sep, value = token.partition('=')
+        if not sep:
+            continue
+        try:
+            values[key] = float(value)
+        except ValueError:
+            raise GameFormatError(f'Bad {what} {token}')
+    return values
+
+def parse_node_tokens(tokens):
+    # tokens of a 'node <history> ...' line, returns the node and its history
+    if len(tokens) < 4:
+        raise GameFormatError('Incomplete node line')
+    history, kind = tokens[1], tokens[2]
+    if kind == 'player':
+        # node <history> player <player> actions <actions...>
+        if len(tokens) < 6 or tokens[4] != 'actions':
+            raise GameFormatError('Expected: node <history> player <player> actions <actions>')
+        node = DecisionNode(tokens[3], tokens[5:])
+    elif kind == 'chance':
+        # node <history> chance actions <action=prob...>
+        if len(tokens) < 5 or tokens[3] != 'actions':
+            raise GameFormatError('Expected: node <history> chance actions <action=prob>')
+        node = ChanceNode(parse_key_values(tokens[4:], 'chance probability'))
+    elif kind == 'terminal':
+        # node <history> terminal payoffs <player=payoff...>
+        if len(tokens) < 5 or tokens[3] != 'payoffs':
+            raise GameFormatError('Expected: node <history> terminal payoffs <player=payoff>')
+        node = TerminalNode(parse_key_values(tokens[4:], 'payoff'))
+    else:
+        raise GameFormatError(f'Unknown node type {kind}')
+    return node, history
+
 def parse_node(line):
     # Parse the nodes to get the node and history
-    if 'player' in line:
-        # Parse decision nodes
-        match = re.match(r'node\s+(\/.*?)\s+player\s+(\d+)\s+actions\s+(.+)', line)
-        if not match:
-            raise Exception
-        history, player, actions_str = match.groups()
-        actions = actions_str.split()
-        node = DecisionNode(player, actions)
-    elif 'chance' in line:
-        # Parse chance nodes
-        match = re.match(r'node\s+(\/.*?)\s+chance\s+actions\s+(.+)', line)
-        if not match:
-            raise Exception
-        history, actions_str = match.groups()
-        probs = {}
-        for a in actions_str.split():
-            if '=' in a:
-                act, prob = a.split('=')
-                probs[act.strip()] = float(prob)
-        node = ChanceNode(probs)
-    elif 'terminal' in line:
-        # Parse terminal nodes
-        match = re.match(r'node\s+(\/.*?)\s+terminal\s+payoffs\s+(.+)', line)
-        if not match:
-            raise Exception
-        history, payoff_str = match.groups()
-        payoffs = {p.split('=')[0]: float(p.split('=')[1]) for p in payoff_str.split()}
-        node = TerminalNode(payoffs)
-    else:
-        # Shouldn't happen
-        raise Exception
-    
+    node, history = parse_node_tokens(line.split())
     # Parse the history to create the edges to traverse to get to where to insert the node in the tree
     path = convert_history_to_path(history)
-    
     return node, path
 
+def parse_infoset_tokens(tokens):
+    # tokens of an 'infoset <name> nodes <histories...>' line, returns the name and node histories
+    if len(tokens) < 4 or tokens[2] != 'nodes':
+        raise GameFormatError('Expected: infoset <name> nodes <histories>')
+    return tokens[1], [t for t in tokens[3:] if t.startswith('/')]
+
 def parse_infoset(line):
-    match = re.match(r'infoset\s+(\/.*?)\s+nodes\s+(.+)', line)
-    if not match:
-        raise Exception
-    name, nodes_str = match.groups()
-    node_histories = [s.strip() for s in nodes_str.split() if s.startswith('/')]
+    name, node_histories = parse_infoset_tokens(line.split())
     # Convert the histories to paths
     paths = [convert_history_to_path(history) for history in node_histories]
     return name, paths
 
-def load_game_from_txt(filepath):
+def load_game_from_txt(filepath, use_cache=False):
+    # With use_cache the game is loaded from a compiled binary cache next to the file when the
+    # cache is fresh, and the cache is (re)written after parsing otherwise, see game_cache.
+    # Rebuilding the tree from the cache is only a little faster than parsing the bundled
+    # games, so it is off by default, the fast path for code working on a FlatGame is
+    # game_cache.load_flat_game
+    if use_cache:
+        from game_cache import load_cached_game
+        return load_cached_game(filepath)
+    return parse_game_file(filepath)
+
+def parse_game_file(filepath):
+    # Stream the file line by line, keeping an index from history to tree node so every
+    # node and info set member is attached in O(1)
+    info_sets = InformationSets()
+    nodes = {} # dict mapping histories to tree nodes
+    root = None
+    line_number = 0
     with open(filepath, 'r') as f:
-        # Convert the file into lines
-        content = f.read()
-        lines = content.splitlines()
-
-        # Create the info sets
-        info_sets = InformationSets()
-
-        # Create the root node
-        node, path = parse_node(lines[0])
-        root = TreeNode(node)
-
-        # Iterate over the rest of the lines
-        for i in range(1, len(lines)):
-            line = lines[i].strip() # remove spaces
-            if line.startswith('node'):
-                # Parse the node
-                node, path = parse_node(line)
-                # Create a tree node
-                tree_node = TreeNode(node)
-                # Add the new node to the tree
-                root.add_node(tree_node, path)
-            elif line.startswith('infoset'):
-                # Parse infoset
-                name, paths = parse_infoset(line)
-                # Add the infoset
-                tree_nodes = []
-                for path in paths:
-                    tree_node = root.get_node(path)
-                    # Add the info set to the node
-                    tree_node.set_info_set(name)
-                    # Keep track of all the nodes
-                    tree_nodes.append(tree_node)
-                info_sets.add_info_set(name, tree_nodes)
-            else:
-                # Shouldn't happen
-                raise Exception
-            
-        return root, info_sets
+        try:
+            for line_number, line in enumerate(f, 1):
+                tokens = line.split()
+                if not tokens:
+                    continue
+                if tokens[0] == 'node':
+                    node, history = parse_node_tokens(tokens)
+                    if history in nodes:
+                        raise GameFormatError(f'Duplicate node {history}')
+                    tree_node = TreeNode(node)
+                    if root is None:
+                        # The first node is the root
+                        root = tree_node
+                    else:
+                        parent_history, action = split_history(history)
+                        parent = nodes.get(parent_history)
+                        if parent is None:
+                            raise GameFormatError(f'Node {history} appears before its parent {parent_history}')
+                        tree_node.set_parent(parent)
+                        parent.set_child(action, tree_node)
+                    nodes[history] = tree_node
+                elif tokens[0] == 'infoset':
+                    name, node_histories = parse_infoset_tokens(tokens)
+                    tree_nodes = []
+                    for history in node_histories:
+                        tree_node = nodes.get(history)
+                        if tree_node is None:
+                            raise GameFormatError(f'Info set {name} refers to unknown node {history}')
+                        # Add the info set to the node
+                        tree_node.set_info_set(name)
+                        tree_nodes.append(tree_node)
+                    info_sets.add_info_set(name, tree_nodes)
+                else:
+                    raise GameFormatError(f'Unknown line type {tokens[0]}')
+        except GameFormatError as e:
+            raise GameFormatError(str(e), filepath, line_number) from None
+
+    if root is None:
+        raise GameFormatError('No nodes in game file', filepath)
+    return root, info_sets
 
 ### Basic tests ###
 
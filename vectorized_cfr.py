@@ -0,0 +1,101 @@
+import numpy as np
+from flat_game import TERMINAL, CHANCE, DECISION
+
+### Dense table helpers ###
+
+def regret_matching_table(game, regrets):
+    # Regret matching for every info set at once, uniform where no regret is positive
+    positive_regrets = np.where(game.action_mask, np.maximum(regrets, 0), 0)
+    normalizer = positive_regrets.sum(axis=1, keepdims=True)
+    return np.where(normalizer > 0, positive_regrets / np.where(normalizer > 0, normalizer, 1),
+                    game.uniform_strategy())
+
+def normalize_table(game, strategy_sum):
+    # Same as normalize for every info set at once, uniform where all counts are zero
+    total = strategy_sum.sum(axis=1, keepdims=True)
+    return np.where(total > 0, strategy_sum / np.where(total > 0, total, 1),
+                    game.uniform_strategy())
+
+### Level by level CFR passes over a FlatGame ###
+
+class VectorizedCFR:
+    def __init__(self, game):
+        self.game = game
+        num_actions = game.max_actions
+        parent = game.parent[1:]
+        children = np.arange(1, game.num_nodes)
+
+        # Edges out of decision nodes, indexed into the flattened (info sets, actions) tables
+        decision_edges = game.kind[parent] == DECISION
+        self.edge_child = children[decision_edges]
+        self.edge_parent = parent[decision_edges]
+        self.edge_player = game.player[self.edge_parent].astype(np.int64)
+        self.edge_slot = (game.info_set[self.edge_parent].astype(np.int64) * num_actions
+                          + game.edge_action[self.edge_child])
+        self.table_size = game.num_info_sets * num_actions
+
+        # Positions of the decision edges in flattened (nodes, players) arrays
+        self.edge_reach_slot = self.edge_child * 2 + self.edge_player
+        self.parent_own_slot = self.edge_parent * 2 + self.edge_player
+        self.parent_opp_slot = self.edge_parent * 2 + 1 - self.edge_player
+
+        # Chance edges multiply both players' reach, other edges leave it unchanged
+        self.base_reach_factor = np.ones((game.num_nodes, 2))
+        chance_children = children[game.kind[parent] == CHANCE]
+        self.base_reach_factor[chance_children] = game.prob[chance_children, None]
+        self.base_reach_factor[self.edge_child] = 1.0
+
+        # Per level, the parents of its nodes, and the non terminal nodes with the offsets
+        # of their children in the next level
+        self.levels = list(game.levels())
+        self.level_parents = [game.parent[start:end] for start, end in self.levels]
+        self.level_nonterminals = []
+        for start, end in self.levels:
+            nodes = np.arange(start, end)
+            nodes = nodes[game.kind[start:end] != TERMINAL]
+            self.level_nonterminals.append((nodes, game.child_start[nodes] - end))
+
+    def cfr_pass(self, strategy, update_player=None):
+        # One CFR iteration for a fixed current strategy, returns the root utilities and the
+        # regret and strategy sum increments as dense (info sets, actions) tables. If
+        # update_player is given only that player's tables are updated
+        game = self.game
+        n = game.num_nodes
+        sigma = strategy.ravel()[self.edge_slot]
+
+        # Probability of each edge and the factor it contributes to each player's reach
+        edge_prob = game.prob.copy()
+        edge_prob[self.edge_child] = sigma
+        reach_factor = self.base_reach_factor.copy()
+        reach_factor.ravel()[self.edge_reach_slot] = sigma
+
+        # Top down pass for reach probabilities
+        reach = np.ones((n, 2))
+        for d in range(1, len(self.levels)):
+            start, end = self.levels[d]
+            reach[start:end] = reach[self.level_parents[d]] * reach_factor[start:end]
+
+        # Bottom up pass for expected utilities
+        values = game.payoffs.copy()
+        for d in range(len(self.levels) - 2, -1, -1):
+            nodes, offsets = self.level_nonterminals[d]
+            if len(nodes) == 0:
+                continue
+            start, end = self.levels[d+1]
+            weighted = values[start:end] * edge_prob[start:end, None]
+            values[nodes] = np.add.reduceat(weighted, offsets, axis=0)
+
+        # Regret and strategy sum increments, scattered into the dense tables
+        values_flat = values.ravel()
+        regret = values_flat[self.edge_reach_slot] - values_flat[self.parent_own_slot]
+        regret_weight = reach.ravel()[self.parent_opp_slot]
+        strategy_weight = reach.ravel()[self.parent_own_slot]
+        if update_player is not None:
+            update = self.edge_player == update_player
+            regret_weight = regret_weight * update
+            strategy_weight = strategy_weight * update
+        regret_delta = np.bincount(self.edge_slot, regret_weight * regret, minlength=self.table_size)
+        strategy_delta = np.bincount(self.edge_slot, strategy_weight * sigma, minlength=self.table_size)
+
+        shape = strategy.shape
+        return values[0], regret_delta.reshape(shape), strategy_delta.reshape(shape)